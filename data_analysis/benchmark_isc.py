@@ -0,0 +1,297 @@
+'''
+Synthetic-cohort benchmark of the ISC engine in isc_analysis.py.
+
+Generates a cohort of synthetic subjects (packed envelope stores plus ROWS/ROWE
+event metadata in the format of load_run_metadata) with a shared signal of
+configurable strength, then times the stages of the batched engine on every
+pair: loading, event alignment, envelopes, correlation, time-shift permutation
+and noise baseline, followed by the full pairwise and leave-one-out passes.
+
+For each stage the wall time (best and median over repeats), the peak RSS and
+the throughput in channel-seconds per second are reported, and one JSON record
+per invocation is appended to --output so results can be compared across
+versions:
+
+    python benchmark_isc.py --subjects 4 --channels 64 --duration 300 --sfreq 250 --output isc_benchmark.jsonl
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from itertools import combinations
+
+import numpy as np
+
+import isc_analysis as isc
+from envelope_store import write_packed_envelopes
+
+SESSION = "benchmark"
+RUN = "run1"
+TASK = "reading"
+
+
+def synthetic_event_data(n_samples, sfreq, n_events, rng):
+    '''
+    ROWS/ROWE event metadata of one synthetic run, same keys as load_run_metadata.
+
+    Rows cover the whole run back to back. The first ROWS is shifted by a random
+    offset so the absolute sample numbers differ between subjects.
+    '''
+    offset = int(rng.integers(0, int(sfreq) + 1))
+    bounds = np.linspace(0, n_samples, n_events + 1).round().astype(int) + offset
+    event_groups = [
+        {'group_id': i + 1, 'rows_sample': int(bounds[i]), 'rowe_sample': int(bounds[i + 1])}
+        for i in range(n_events)
+    ]
+    return {
+        'event_groups': event_groups,
+        'sfreq': float(sfreq),
+        'ch_names': [],
+        'source': 'synthetic',
+        'start_sample': int(bounds[0]),
+        'end_sample': int(bounds[-1]),
+        'data_length': n_samples,
+    }
+
+
+def generate_cohort(input_base, n_subjects, n_channels, n_samples, sfreq, n_events, shared, bands, seed):
+    '''
+    Write a synthetic cohort as packed envelope stores under input_base.
+
+    Every channel of every subject is shared * s(t) + sqrt(1 - shared^2) * own noise,
+    with one common s(t) per channel.
+
+    :return: (subjects, channels, {subject: event_data})
+    '''
+    rng = np.random.default_rng(seed)
+    channels = [f"E{i + 1}" for i in range(n_channels)]
+    subjects = [f"bench{i + 1:02d}" for i in range(n_subjects)]
+    common = rng.standard_normal((n_channels, n_samples)).astype(np.float32)
+    own_weight = np.sqrt(max(1 - shared**2, 0))
+
+    event_data = {}
+    for subj in subjects:
+        event_data[subj] = synthetic_event_data(n_samples, sfreq, n_events, rng)
+        event_data[subj]['ch_names'] = channels
+        for band in bands:
+            data = shared * common + own_weight * rng.standard_normal((n_channels, n_samples)).astype(np.float32)
+            data_dir = os.path.join(input_base, f"{subj}_electrode", band)
+            write_packed_envelopes(data_dir, subj, SESSION, RUN, band, channels, data)
+    return subjects, channels, event_data
+
+
+def current_rss_peak():
+    # VmHWM can be reset per stage on Linux, ru_maxrss is the peak of the whole process
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def reset_rss_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def time_stage(name, func, repeats, channel_seconds):
+    '''
+    Run func repeats times.
+
+    :param channel_seconds: channels x seconds of data processed by one call
+    :return: (stage record, result of the last call)
+    '''
+    timings = []
+    per_stage_peak = reset_rss_peak()
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    record = {
+        "stage": name,
+        "wall_time_best": best,
+        "wall_time_median": float(np.median(timings)),
+        "repeats": repeats,
+        "peak_rss_bytes": current_rss_peak(),
+        "peak_rss_scope": "stage" if per_stage_peak else "process",
+        "channel_seconds": channel_seconds,
+        "channel_seconds_per_s": channel_seconds / best if best > 0 else None,
+    }
+    print(f"{name:<14} best {best:8.3f} s | median {record['wall_time_median']:8.3f} s | "
+          f"peak RSS {record['peak_rss_bytes'] / 2**20:8.1f} MiB | "
+          f"{record['channel_seconds_per_s'] or 0:12.1f} channel-s/s")
+    return record, result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    isc.NUM_SHUFFLES = args.shuffles
+    isc.CHANNEL_BLOCK_SIZE = args.block_size
+    isc.LOW_MEMORY = args.low_memory
+    if args.backend != isc.ARRAY_BACKEND:
+        isc.ARRAY_BACKEND = args.backend
+        isc.BACKEND = isc.get_backend(args.backend)
+
+    n_samples = int(round(args.duration * args.sfreq))
+    bands = isc.FREQUENCY_BANDS[:args.bands]
+    work_dir = tempfile.mkdtemp(prefix="isc_benchmark_", dir=args.work_dir)
+    isc.INPUT_BASE = os.path.join(work_dir, "frequency")
+
+    try:
+        subjects, channels, event_data = generate_cohort(
+            isc.INPUT_BASE, args.subjects, args.channels, n_samples, args.sfreq,
+            args.events, args.shared, bands, args.seed
+        )
+        pairs = list(combinations(subjects, 2))
+        band = bands[0]
+        pair_channel_seconds = len(pairs) * args.channels * args.duration
+        rng = np.random.default_rng(args.seed)
+        stages = []
+
+        def load():
+            return {
+                subj: {b: isc.load_subject_data(subj, SESSION, RUN, b, None, TASK, event_data=event_data[subj]) for b in bands}
+                for subj in subjects
+            }
+        record, all_subj_data = time_stage("load", load, args.repeats, len(subjects) * len(bands) * args.channels * args.duration)
+        stages.append(record)
+
+        def align():
+            return [
+                isc.stack_aligned_channels(all_subj_data[s1][band]['electrode_data'], all_subj_data[s2][band]['electrode_data'],
+                                           event_data[s1], event_data[s2], channels)
+                for s1, s2 in pairs
+            ]
+        record, stacks = time_stage("alignment", align, args.repeats, pair_channel_seconds)
+        stages.append(record)
+
+        def envelopes():
+            return [(isc.extract_envelopes(data1), isc.extract_envelopes(data2)) for _, data1, data2 in stacks]
+        record, pair_envelopes = time_stage("envelope", envelopes, args.repeats, pair_channel_seconds)
+        stages.append(record)
+
+        def correlation():
+            return [isc.pearson_correlation_rows(env1, env2) for env1, env2 in pair_envelopes]
+        record, _ = time_stage("correlation", correlation, args.repeats, pair_channel_seconds)
+        stages.append(record)
+
+        def permutation():
+            for env1, env2 in pair_envelopes:
+                shift_points = rng.integers(1, env2.shape[1], size=isc.NUM_SHUFFLES)
+                for start in range(0, len(channels), isc.CHANNEL_BLOCK_SIZE):
+                    block = slice(start, start + isc.CHANNEL_BLOCK_SIZE)
+                    n_block = len(channels[block])
+                    isc.circular_shift_correlation(env1[block], env2[block],
+                                                   np.broadcast_to(shift_points, (n_block, len(shift_points))))
+        record, _ = time_stage("permutation", permutation, args.repeats, pair_channel_seconds)
+        stages.append(record)
+
+        def noise():
+            for (_, _, data2), (env1, _) in zip(stacks, pair_envelopes):
+                noise_data = isc.generate_window_noise(data2, args.sfreq, rng)
+                isc.pearson_correlation_rows(env1, isc.extract_envelopes(noise_data))
+        record, _ = time_stage("noise", noise, args.repeats, pair_channel_seconds)
+        stages.append(record)
+        del stacks, pair_envelopes
+
+        def pairwise():
+            return [
+                isc.calculate_pair_correlation_batched(all_subj_data[s1][band], all_subj_data[s2][band],
+                                                       event_data[s1], event_data[s2], channels, rng=rng)
+                for s1, s2 in pairs
+            ]
+        record, pair_results = time_stage("pairwise", pairwise, args.repeats, pair_channel_seconds)
+        # recovered shared signal, a sanity check that the synthetic cohort is being correlated
+        record["mean_r"] = float(np.mean([result[ch]["original"]["r"] for result in pair_results for ch in channels]))
+        stages.append(record)
+
+        if len(subjects) > 1:
+            def leave_one_out():
+                band_data = {subj: all_subj_data[subj][band] for subj in subjects}
+                return isc.calculate_leave_one_out_correlation(band_data, subjects, channels, rng=rng)
+            record, _ = time_stage("leave_one_out", leave_one_out, args.repeats,
+                                   len(subjects) * args.channels * args.duration)
+            stages.append(record)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "config": {
+            "subjects": args.subjects,
+            "pairs": len(pairs),
+            "channels": args.channels,
+            "duration": args.duration,
+            "sfreq": args.sfreq,
+            "events": args.events,
+            "shared": args.shared,
+            "bands": len(bands),
+            "num_shuffles": isc.NUM_SHUFFLES,
+            "channel_block_size": isc.CHANNEL_BLOCK_SIZE,
+            "low_memory": isc.LOW_MEMORY,
+            "seed": args.seed,
+        },
+        "environment": {
+            "backend": isc.BACKEND.name,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "stages": stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ISC engine on a synthetic cohort')
+    parser.add_argument('--subjects', type=int, default=4)
+    parser.add_argument('--channels', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=120.0, help='seconds of data per run')
+    parser.add_argument('--sfreq', type=float, default=250.0)
+    parser.add_argument('--events', type=int, default=20, help='ROWS/ROWE rows per run')
+    parser.add_argument('--shared', type=float, default=0.5, help='weight of the shared signal, 0 to 1')
+    parser.add_argument('--bands', type=int, default=1, help='number of bands to generate and load')
+    parser.add_argument('--shuffles', type=int, default=isc.NUM_SHUFFLES)
+    parser.add_argument('--block_size', type=int, default=isc.CHANNEL_BLOCK_SIZE)
+    parser.add_argument('--backend', type=str, default=isc.ARRAY_BACKEND)
+    parser.add_argument('--low_memory', action='store_true', help='float32 envelopes and chunked accumulation')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work_dir', type=str, default=None, help='where the synthetic stores are written')
+    parser.add_argument('--output', type=str, default='isc_benchmark.jsonl')
+
+    args = parser.parse_args()
+
+    record = run_benchmark(args)
+    with open(args.output, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Benchmark record appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+'''
+Compute the band-passed signals used by isc_analysis.py from preprocessed BIDS data.
+
+Each preprocessed BrainVision run is read once. All channels are band-pass
+filtered together with a cached SOS filter bank (Delta, Theta, Alpha, Beta), and
+the band-passed signal is cropped to the first ROWS / last ROWE span and written
+to the packed store of envelope_store.py under INPUT_BASE/{subject}_electrode/{band}
+(the store keeps the "envelopes" file names that isc_analysis.py reads). The
+Hilbert envelope is not taken here: isc_analysis.py envelopes the loaded data
+itself (and the "shift" permutation engine has to shift the signal before
+enveloping it), so storing envelopes would make the ISC run on the envelope of
+an envelope.
+'''
+import os
+import argparse
+from functools import lru_cache
+
+import mne
+import numpy as np
+from scipy.signal import butter, sosfiltfilt
+
+from envelope_store import write_packed_envelopes
+from isc_analysis import INPUT_BASE, FREQUENCY_BANDS, find_bids_vhdr_file, load_run_metadata
+
+BAND_EDGES = {
+    'Delta': (1.0, 4.0),
+    'Theta': (4.0, 8.0),
+    'Alpha': (8.0, 13.0),
+    'Beta': (13.0, 30.0),
+}
+
+
+@lru_cache(maxsize=None)
+def design_filter_bank(sfreq, order=4, bands=tuple(FREQUENCY_BANDS)):
+    '''
+    Butterworth band-pass filters for every band, designed once per sampling rate.
+
+    :return: dict {band: second-order sections}
+    '''
+    return {
+        band: butter(order, BAND_EDGES[band], btype='bandpass', fs=sfreq, output='sos')
+        for band in bands
+    }
+
+
+def compute_band_signals(data, sfreq, order=4, bands=tuple(FREQUENCY_BANDS)):
+    '''
+    Zero-phase band-pass of all channels, band by band.
+
+    :param data: array of shape (n_channels, n_samples)
+    :return: dict {band: float32 array of shape (n_channels, n_samples)}
+    '''
+    filter_bank = design_filter_bank(float(sfreq), order, tuple(bands))
+    return {
+        band: sosfiltfilt(filter_bank[band], data, axis=-1).astype(np.float32)
+        for band in bands
+    }
+
+
+def process_run(subject, session, run, task, bids_root, output_base=INPUT_BASE, order=4):
+    vhdr_path = find_bids_vhdr_file(bids_root, subject, session, task, run)
+    if vhdr_path is None:
+        return
+
+    raw = mne.io.read_raw_brainvision(vhdr_path, preload=True)
+    raw.pick_types(eeg=True)
+    sfreq = raw.info['sfreq']
+    signals = compute_band_signals(raw.get_data(), sfreq, order=order)
+
+    # filter the whole run first so the crop does not add edge artifacts
+    event_data = load_run_metadata(subject, session, run, bids_root, task)
+    data_length = event_data.get('data_length')
+    start = event_data['start_sample'] if data_length else 0
+    stop = start + data_length if data_length else raw.n_times
+
+    for band, band_data in signals.items():
+        data_dir = os.path.join(output_base, f"{subject}_electrode", band)
+        write_packed_envelopes(data_dir, subject, session, run, band, raw.ch_names, band_data[:, start:stop])
+        print(f"Saved {band} signals: {subject} | {session} | {run} | {stop - start} samples")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute band-passed inputs for the ISC analysis')
+    parser.add_argument('--bids_root', type=str, default='example_bids/derivatives/preprocessed')
+    parser.add_argument('--subjects', type=str, nargs='+', default=['subj1', 'subj2'])
+    parser.add_argument('--sessions', type=str, nargs='+', default=['littleprince'])
+    parser.add_argument('--runs', type=str, nargs='+', default=['runs1', 'runs2'])
+    parser.add_argument('--task', type=str, default='reading')
+    parser.add_argument('--output_base', type=str, default=INPUT_BASE)
+    parser.add_argument('--filter_order', type=int, default=4)
+
+    args = parser.parse_args()
+
+    for subject in args.subjects:
+        for session in args.sessions:
+            for run in args.runs:
+                process_run(subject, session, run, args.task, args.bids_root,
+                            output_base=args.output_base, order=args.filter_order)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+'''
+Correlated Component Analysis (CorrCA) used by isc_analysis.py.
+
+Finds the spatial filters that maximise the correlation between subjects
+(Parra et al., 2018). Within-subject covariance Rw = sum_s X_s X_s^T and the
+cohort sum Y = sum_s X_s are accumulated in one streaming pass over subjects,
+the between-subject covariance follows as Rb = Y Y^T - Rw, and a single
+generalized eigenproblem Rb w = lambda Rw w gives the components.
+'''
+import numpy as np
+from scipy.linalg import eigh
+
+
+def corrca_covariances(subject_arrays):
+    '''
+    Accumulate the CorrCA covariance matrices, one subject at a time.
+
+    :param subject_arrays: iterable of (n_channels, n_samples) arrays, same shape for all subjects
+    :return: (Rw, Rb, n_subjects)
+    '''
+    within = None
+    total = None
+    n_subjects = 0
+    for data in subject_arrays:
+        data = np.asarray(data, dtype=float)
+        data = data - np.mean(data, axis=1, keepdims=True)
+        if within is None:
+            within = np.zeros((data.shape[0], data.shape[0]))
+            total = np.zeros_like(data)
+        within += data @ data.T
+        total += data
+        n_subjects += 1
+
+    if within is None:
+        raise ValueError("CorrCA needs at least one subject")
+    between = total @ total.T - within
+    return within, between, n_subjects
+
+
+def corrca_solve(within, between, n_subjects, shrinkage=0.1):
+    '''
+    Solve the CorrCA eigenproblem.
+
+    :param within: within-subject covariance Rw
+    :param between: between-subject covariance Rb
+    :param n_subjects: number of subjects accumulated into the matrices
+    :param shrinkage: weight of the identity (scaled to the mean eigenvalue) mixed into Rw,
+                      keeps Rw invertible after average referencing or interpolation
+    :return: (isc, W, A) with component ISC in descending order, spatial filters W
+             (channels x components) and forward models A (channels x components)
+    '''
+    if n_subjects < 2:
+        raise ValueError("CorrCA needs at least two subjects")
+
+    n_channels = within.shape[0]
+    within_reg = (1 - shrinkage) * within + shrinkage * np.trace(within) / n_channels * np.eye(n_channels)
+    eigvals, filters = eigh(between, within_reg)
+    order = np.argsort(eigvals)[::-1]
+    filters = filters[:, order]
+
+    # ISC of each component on the unregularized covariances
+    within_var = np.diag(filters.T @ within @ filters)
+    isc = np.divide(np.diag(filters.T @ between @ filters), within_var * (n_subjects - 1),
+                    out=np.zeros(n_channels), where=within_var > 1e-12 * np.trace(within))
+    forward = within @ filters @ np.linalg.pinv(filters.T @ within @ filters)
+    return isc, filters, forward
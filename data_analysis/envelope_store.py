@@ -0,0 +1,115 @@
+'''
+Packed envelope store used by isc_analysis.py.
+
+All channels of one subject/session/run/band are kept in a single
+(n_channels, n_samples) float32 .npy file with a JSON channel index next to it,
+so the analysis can open it with np.load(mmap_mode='r') instead of reading one
+small file per channel. A store packed from per-channel files records their
+sizes and modification times, and is repacked when those files change.
+'''
+import os
+import json
+import numpy as np
+
+
+def packed_envelope_paths(data_dir, subject, session, run, band):
+    stem = f"{subject}_{session}_{run}_{band}_envelopes"
+    return os.path.join(data_dir, stem + ".npy"), os.path.join(data_dir, stem + "_channels.json")
+
+
+def channel_source_files(data_dir, subject, session, run, band):
+    # per-channel `*_envelope.npy` files of one subject/session/run/band, {channel: path}
+    channel_files = {}
+    if not os.path.isdir(data_dir):
+        return channel_files
+    for fname in sorted(os.listdir(data_dir)):
+        if f"{subject}_{session}_{run}_{band}" in fname and "_envelope.npy" in fname:
+            ch_name = fname.split("_")[-2]
+            channel_files[ch_name] = os.path.join(data_dir, fname)
+    return channel_files
+
+
+def source_fingerprint(channel_files):
+    fingerprint = {}
+    for ch, path in channel_files.items():
+        stat = os.stat(path)
+        fingerprint[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def write_packed_envelopes(data_dir, subject, session, run, band, channels, envelopes, sources=None):
+    '''
+    Save a (n_channels, n_samples) envelope matrix and its channel index.
+
+    :param channels: channel names, one per row of envelopes
+    :param envelopes: array of shape (n_channels, n_samples)
+    :param sources: source_fingerprint of the per-channel files the matrix was packed from, if any
+    :return: path of the packed .npy file
+    '''
+    array_path, index_path = packed_envelope_paths(data_dir, subject, session, run, band)
+    envelopes = np.asarray(envelopes, dtype=np.float32)
+    if envelopes.ndim != 2 or envelopes.shape[0] != len(channels):
+        raise ValueError(f"expected ({len(channels)}, n_samples) envelopes, got {envelopes.shape}")
+
+    os.makedirs(data_dir, exist_ok=True)
+    # write to temporary names first so readers never see a half written store
+    with open(array_path + ".tmp", "wb") as f:
+        np.save(f, envelopes)
+    with open(index_path + ".tmp", "w") as f:
+        index = {"channels": list(channels), "n_samples": int(envelopes.shape[1]), "dtype": "float32"}
+        if sources is not None:
+            index["sources"] = sources
+        json.dump(index, f, indent=4)
+    os.replace(array_path + ".tmp", array_path)
+    os.replace(index_path + ".tmp", index_path)
+    return array_path
+
+
+def read_packed_envelopes(data_dir, subject, session, run, band, mmap=True):
+    '''
+    Open a packed envelope store.
+
+    :return: (channels, envelopes) with envelopes memory-mapped read-only,
+             or (None, None) if the store does not exist or its per-channel sources changed
+    '''
+    array_path, index_path = packed_envelope_paths(data_dir, subject, session, run, band)
+    if not (os.path.exists(array_path) and os.path.exists(index_path)):
+        return None, None
+
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    # stores written directly (compute_band_signals.py) have no sources to compare
+    if "sources" in index:
+        current = source_fingerprint(channel_source_files(data_dir, subject, session, run, band))
+        if current != index["sources"]:
+            print(f"Per-channel files changed since {array_path} was packed, repacking")
+            return None, None
+    channels = index["channels"]
+    envelopes = np.load(array_path, mmap_mode='r' if mmap else None)
+    return channels, envelopes
+
+
+def pack_channel_files(data_dir, subject, session, run, band):
+    '''
+    Stack the per-channel `*_envelope.npy` files of one subject/session/run/band
+    into the packed layout. Channels are cut to the shortest channel length.
+
+    :return: (channels, envelopes), memory-mapped if the store could be written
+    '''
+    channel_files = channel_source_files(data_dir, subject, session, run, band)
+    if not channel_files:
+        return [], np.empty((0, 0), dtype=np.float32)
+
+    channels = list(channel_files)
+    sources = source_fingerprint(channel_files)
+    rows = [np.load(channel_files[ch]) for ch in channels]
+    n_samples = min(len(row) for row in rows)
+    envelopes = np.stack([row[:n_samples] for row in rows]).astype(np.float32)
+
+    try:
+        write_packed_envelopes(data_dir, subject, session, run, band, channels, envelopes, sources=sources)
+    except OSError as e:
+        print(f"Failed writing packed envelopes in {data_dir}: {e}")
+        return channels, envelopes
+
+    return read_packed_envelopes(data_dir, subject, session, run, band)
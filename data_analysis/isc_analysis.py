@@ -1,27 +1,78 @@
 import os
+import json
+import hashlib
+import zlib
 import numpy as np
 import pandas as pd
 import mne
 from scipy import stats
 from itertools import combinations
-from collections import defaultdict
 import multiprocessing as mp
-from multiprocessing import Pool
-import cupy as cp
-from scipy.signal import hilbert
-import random
-
-try:
-    import cupy as cp
-    GPU_AVAILABLE = True
-except ImportError:
-    GPU_AVAILABLE = False
+from multiprocessing import Pool, shared_memory
+from numpy.lib.stride_tricks import sliding_window_view
+from envelope_store import read_packed_envelopes, pack_channel_files, packed_envelope_paths
+from isc_backend import get_backend
+from isc_results import correlation_rows, append_unit, stored_units
+from corrca import corrca_covariances, corrca_solve
+from isc_scheduler import worker_count
+from isc_profile import stage, timed, count, take_stats, add_stats, merge_stats, Progress
 
 INPUT_BASE = "../data/frequency"  
 OUTPUT_BASE = "output_path"
+METADATA_CACHE_DIR = os.path.join(OUTPUT_BASE, "metadata_cache")
 FREQUENCY_BANDS = ['Delta', 'Theta', 'Alpha', 'Beta']
 BONFERRONI_P_THRESH = 1e-6
+# channel selection: "bonferroni" (parametric p < BONFERRONI_P_THRESH), "fwer" (max-statistic
+# permutation p) or "fdr" (Benjamini-Hochberg on the permutation p), both at PERMUTATION_ALPHA
+SIGNIFICANCE_METHOD = "bonferroni"
+PERMUTATION_ALPHA = 0.05
 NUM_PROCESSES = 3  
+NUM_SHUFFLES = 500
+# "fft": every circular shift from one cross-correlation, "shift": rebuild each shifted copy
+PERMUTATION_ENGINE = "fft"
+# "batched": all channels of a pair as one (channels, samples) matrix, "pool": one pool task per channel
+ISC_ENGINE = "batched"
+CHANNEL_BLOCK_SIZE = 32
+# bounded memory for very long recordings: envelopes are kept as float32, Pearson sums are accumulated
+# in float64 over ACCUMULATION_CHUNK samples, channel blocks shrink to fit LOW_MEMORY_BLOCK_BYTES and
+# the "shift" permutation engine builds one shifted copy at a time
+LOW_MEMORY = False
+ACCUMULATION_CHUNK = 2**20
+LOW_MEMORY_BLOCK_BYTES = 2**30
+# "auto" (CuPy if a GPU is usable, else NumPy), "numpy", "cupy" or "numba"
+ARRAY_BACKEND = "auto"
+BACKEND = get_backend(ARRAY_BACKEND)
+GPU_AVAILABLE = BACKEND.name == "cupy"
+# skip (session, run, pair, band) units whose inputs and parameters match the manifest
+RESUME = True
+# keep the leave-one-out cohort envelope sums, a new subject is added to them instead of
+# rebuilding them from every subject (pairwise units of existing pairs are skipped by RESUME)
+INCREMENTAL_COHORT = True
+# seed for the time-shift and noise draws, None draws fresh randomness on every run
+NOISE_SEED = None
+# window length in seconds for time-resolved pairwise ISC curves, None to skip them
+SLIDING_WINDOW_SECONDS = None
+SLIDING_STEP_SECONDS = 1.0
+# also correlate every matched ROWS/ROWE row of a pair (per-sentence ISC for the reading task)
+ROW_LEVEL_ISC = False
+# identity shrinkage of the within-subject covariance for isc_mode "corrca"
+CORRCA_SHRINKAGE = 0.1
+# "units": main() flattens every (session, run, pair, band) unit of the sweep (and the leave-one-out /
+# CorrCA band units) into one task list run on a worker pool, "serial": one session/run at a time.
+# The unit scheduler uses the batched engine, ISC_ENGINE "pool" always runs serially.
+SCHEDULER = "units"
+# None sizes the worker count from the usable cores and the available memory
+SCHEDULER_WORKERS = None
+SCHEDULER_MEMORY_FRACTION = 0.8
+# per-unit stage timings, counters and ETA appended as JSON lines to OUTPUT_BASE/{task}/TRACE_FILE, None to disable
+TRACE_FILE = "isc_trace.jsonl"
+# "table": rows in the HDF5 result table (isc_results.py), "npy": pickled dict per pair, "both"
+RESULT_FORMAT = "table"
+
+_RUN_METADATA_CACHE = {}
+# shared memory blocks a pool worker has attached to, by block name
+_WORKER_SHARED_BLOCKS = {}
+MAX_WORKER_SHARED_BLOCKS = 16
 
 
 def analyze_band_proportions(significant_chs, band, total_common_chs):
@@ -59,6 +110,7 @@ def extract_epoch_data(raw, event_groups):
         return None
 
 
+@timed("alignment")
 def align_data_based_on_events(subj1_data, subj2_data, subj1_event_data, subj2_event_data, common_chs):
 
     subj1_events = subj1_event_data.get('event_groups', [])
@@ -129,73 +181,85 @@ def find_bids_events_file(bids_root, subject, session, task, run):
     
     print(f"Not found: {events_path}")
     return None
-def load_subject_data(subject, session, run, band, bids_root, task):
-    data_dir = os.path.join(INPUT_BASE, f"{subject}_electrode", band)
-    electrode_data = {}
-    
-    for fname in os.listdir(data_dir):
-        if f"{subject}_{session}_{run}_{band}" in fname and "_envelope.npy" in fname:
-            ch_name = fname.split("_")[-2]
-            file_path = os.path.join(data_dir, fname)
-            electrode_data[ch_name] = np.load(file_path)
-    
-    event_data = {}
+def file_fingerprint(paths):
+    fingerprint = []
+    for path in paths:
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint.append([path, stat.st_size, stat.st_mtime_ns])
+        else:
+            fingerprint.append([path, None, None])
+    return fingerprint
+
+def run_metadata_cache_path(subject, session, run, task):
+    return os.path.join(METADATA_CACHE_DIR, f"sub-{subject}_ses-{session}_task-{task}_run-{run}_metadata.json")
+
+@timed("metadata")
+def load_run_metadata(subject, session, run, bids_root, task):
+    # Events and recording info of one subject/session/run, shared by every band.
+    # Memoized in memory and as a JSON sidecar, keyed on the BIDS files it was read from.
     vhdr_path = find_bids_vhdr_file(bids_root, subject, session, task, run)
     events_path = find_bids_events_file(bids_root, subject, session, task, run)
-    
-    if vhdr_path and os.path.exists(vhdr_path):
+    eeg_path = vhdr_path[:-len(".vhdr")] + ".eeg" if vhdr_path else None
+    fingerprint = file_fingerprint([vhdr_path, eeg_path, events_path])
+
+    cache_key = (subject, session, run, task, bids_root)
+    cached = _RUN_METADATA_CACHE.get(cache_key)
+    if cached is not None and cached['fingerprint'] == fingerprint:
+        return cached
+
+    cache_path = run_metadata_cache_path(subject, session, run, task)
+    if vhdr_path and os.path.exists(cache_path):
         try:
-            raw = mne.io.read_raw_brainvision(vhdr_path, preload=True)
-            sfreq = raw.info['sfreq']
-            events_from_vhdr = None
-            try:
-                events_from_vhdr = mne.events_from_annotations(raw)
-                print(f"reading {len(events_from_vhdr[0])} events")
-            except Exception as e:
-                print(f"Failed reading events: {e}")
-            
-            events_from_tsv = None
-            if events_path and os.path.exists(events_path):
-                try:
-                    events_df = pd.read_csv(events_path, sep='	')
-                    rows_events = events_df[events_df['trial_type'].str.lower().str.contains('rows', na=False)]
-                    rowe_events = events_df[events_df['trial_type'].str.lower().str.contains('rowe', na=False)]
-                    rows_samples = (rows_events['onset'] * sfreq).round().astype(int).tolist()
-                    rowe_samples = (rowe_events['onset'] * sfreq).round().astype(int).tolist()
-                    event_groups = []
-                    min_length = min(len(rows_samples), len(rowe_samples))
-                    
-                    for i in range(min_length):
-                        event_groups.append({
-                            'group_id': i + 1,
-                            'rows_sample': rows_samples[i],
-                            'rowe_sample': rowe_samples[i]
-                        })
-                    
-                    events_from_tsv = {
-                        'event_groups': event_groups,
-                        'sfreq': sfreq,
-                        'ch_names': raw.ch_names,
-                        'source': 'tsv_file'
-                    }
-                 
-                except Exception as e:
-                    print(f"Failed reading events: {e}")
-            
-            if events_from_tsv:
-                event_data = events_from_tsv
-            elif events_from_vhdr:
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            if cached.get('fingerprint') == fingerprint:
+                _RUN_METADATA_CACHE[cache_key] = cached
+                return cached
+        except (OSError, ValueError) as e:
+            print(f"Ignoring metadata cache {cache_path}: {e}")
 
-                events, event_id = events_from_vhdr
-                rows_mask = np.array([str(k).lower().startswith('rows') for k in event_id.keys()])
-                rowe_mask = np.array([str(k).lower().startswith('rowe') for k in event_id.keys()])
-                
-                rows_codes = np.array(list(event_id.values()))[rows_mask]
-                rowe_codes = np.array(list(event_id.values()))[rowe_mask]
-                
-                rows_samples = events[np.isin(events[:, 2], rows_codes), 0].tolist()
-                rowe_samples = events[np.isin(events[:, 2], rowe_codes), 0].tolist()
+    event_data = read_run_metadata(vhdr_path, events_path)
+    event_data['source_file'] = vhdr_path
+    event_data['events_file'] = events_path
+    event_data['fingerprint'] = fingerprint
+
+    if event_data['source'] in ('tsv_file', 'vhdr_annotations', 'no_events'):
+        _RUN_METADATA_CACHE[cache_key] = event_data
+        try:
+            os.makedirs(METADATA_CACHE_DIR, exist_ok=True)
+            with open(cache_path, "w") as f:
+                json.dump(event_data, f, indent=4)
+        except OSError as e:
+            print(f"Failed writing metadata cache {cache_path}: {e}")
+
+    return event_data
+
+def read_run_metadata(vhdr_path, events_path):
+    if not (vhdr_path and os.path.exists(vhdr_path)):
+        print("vhdr not found")
+        return {'event_groups': [], 'sfreq': None, 'ch_names': [], 'source': 'file_not_found'}
 
+    event_data = {}
+    try:
+        # only the header, annotations and length are needed, not the samples
+        raw = mne.io.read_raw_brainvision(vhdr_path, preload=False)
+        sfreq = raw.info['sfreq']
+        events_from_vhdr = None
+        try:
+            events_from_vhdr = mne.events_from_annotations(raw)
+            print(f"reading {len(events_from_vhdr[0])} events")
+        except Exception as e:
+            print(f"Failed reading events: {e}")
+        
+        events_from_tsv = None
+        if events_path and os.path.exists(events_path):
+            try:
+                events_df = pd.read_csv(events_path, sep='	')
+                rows_events = events_df[events_df['trial_type'].str.lower().str.contains('rows', na=False)]
+                rowe_events = events_df[events_df['trial_type'].str.lower().str.contains('rowe', na=False)]
+                rows_samples = (rows_events['onset'] * sfreq).round().astype(int).tolist()
+                rowe_samples = (rowe_events['onset'] * sfreq).round().astype(int).tolist()
                 event_groups = []
                 min_length = min(len(rows_samples), len(rowe_samples))
                 
@@ -206,44 +270,89 @@ def load_subject_data(subject, session, run, band, bids_root, task):
                         'rowe_sample': rowe_samples[i]
                     })
                 
-                event_data = {
+                events_from_tsv = {
                     'event_groups': event_groups,
                     'sfreq': sfreq,
                     'ch_names': raw.ch_names,
-                    'source': 'vhdr_annotations'
+                    'source': 'tsv_file'
                 }
-            else:
-                print("Did not read any events")
-                event_data = {'event_groups': [], 'sfreq': sfreq, 'ch_names': raw.ch_names, 'source': 'no_events'}
+             
+            except Exception as e:
+                print(f"Failed reading events: {e}")
+        
+        if events_from_tsv:
+            event_data = events_from_tsv
+        elif events_from_vhdr:
+
+            events, event_id = events_from_vhdr
+            rows_mask = np.array([str(k).lower().startswith('rows') for k in event_id.keys()])
+            rowe_mask = np.array([str(k).lower().startswith('rowe') for k in event_id.keys()])
             
-            if event_data['event_groups']:
-                epoch_raw = extract_epoch_data(raw, event_data['event_groups'])
-                if epoch_raw is not None:
-                    epoch_data = epoch_raw.get_data()
-                    ch_names = epoch_raw.ch_names
-
-                    for i, ch in enumerate(ch_names):
-                        if ch in electrode_data:
-                            electrode_data[ch] = electrode_data[ch][:len(epoch_data[i])]
-                    event_data.update({
-                        'start_sample': event_data['event_groups'][0]['rows_sample'],
-                        'end_sample': event_data['event_groups'][-1]['rowe_sample'],
-                        'data_length': len(epoch_data[0]) if epoch_data.size > 0 else 0
-                    })
+            rows_codes = np.array(list(event_id.values()))[rows_mask]
+            rowe_codes = np.array(list(event_id.values()))[rowe_mask]
             
-        except Exception as e:
-            print(f"Failed loading data: {e}")
-            event_data = {'event_groups': [], 'sfreq': None, 'ch_names': [], 'source': 'load_failure'}
-    else:
-        print(f"{subject} vhdr not found")
-        event_data = {'event_groups': [], 'sfreq': None, 'ch_names': [], 'source': 'file_not_found'}
+            rows_samples = events[np.isin(events[:, 2], rows_codes), 0].tolist()
+            rowe_samples = events[np.isin(events[:, 2], rowe_codes), 0].tolist()
+
+            event_groups = []
+            min_length = min(len(rows_samples), len(rowe_samples))
+            
+            for i in range(min_length):
+                event_groups.append({
+                    'group_id': i + 1,
+                    'rows_sample': rows_samples[i],
+                    'rowe_sample': rowe_samples[i]
+                })
+            
+            event_data = {
+                'event_groups': event_groups,
+                'sfreq': sfreq,
+                'ch_names': raw.ch_names,
+                'source': 'vhdr_annotations'
+            }
+        else:
+            print("Did not read any events")
+            event_data = {'event_groups': [], 'sfreq': sfreq, 'ch_names': raw.ch_names, 'source': 'no_events'}
+        
+        if event_data['event_groups']:
+            epoch_raw = extract_epoch_data(raw, event_data['event_groups'])
+            if epoch_raw is not None:
+                event_data.update({
+                    'start_sample': event_data['event_groups'][0]['rows_sample'],
+                    'end_sample': event_data['event_groups'][-1]['rowe_sample'],
+                    'data_length': epoch_raw.n_times
+                })
+        
+    except Exception as e:
+        print(f"Failed loading data: {e}")
+        event_data = {'event_groups': [], 'sfreq': None, 'ch_names': [], 'source': 'load_failure'}
+
+    return event_data
+
+@timed("load")
+def load_subject_data(subject, session, run, band, bids_root, task, event_data=None):
+    data_dir = os.path.join(INPUT_BASE, f"{subject}_electrode", band)
+
+    # rows of the packed (n_channels, n_samples) store are memory-mapped views
+    channels, envelopes = read_packed_envelopes(data_dir, subject, session, run, band)
+    if channels is None:
+        channels, envelopes = pack_channel_files(data_dir, subject, session, run, band)
+    electrode_data = {ch: envelopes[i] for i, ch in enumerate(channels)}
+    input_fingerprint = file_fingerprint(packed_envelope_paths(data_dir, subject, session, run, band))
     
-    event_data['source_file'] = vhdr_path
-    event_data['events_file'] = events_path
+    if event_data is None:
+        event_data = load_run_metadata(subject, session, run, bids_root, task)
+
+    data_length = event_data.get('data_length')
+    if data_length:
+        for ch in event_data['ch_names']:
+            if ch in electrode_data:
+                electrode_data[ch] = electrode_data[ch][:data_length]
     
     return {
         'electrode_data': electrode_data,
-        'event_data': event_data
+        'event_data': event_data,
+        'input_fingerprint': input_fingerprint
     }
 def find_bids_vhdr_file(bids_root, subject, session, task, run):
     vhdr_fname = f"sub-{subject}_ses-{session}_task-{task}_run-{run}_eeg.vhdr"
@@ -264,117 +373,170 @@ def find_bids_vhdr_file(bids_root, subject, session, task, run):
 
 
 def extract_envelope_gpu(signal_data):
-    if not GPU_AVAILABLE or len(signal_data) < 100:
-        from scipy.signal import hilbert
-        try:
-            analytic_signal = hilbert(signal_data)
-            envelope = np.abs(analytic_signal)
-            return envelope
-        except Exception as e:
-            return signal_data
-    
-    try:
-        signal_gpu = cp.asarray(signal_data)
-        N = len(signal_gpu)
-        if N < 2:
-            return cp.asnumpy(signal_gpu)
-        fft_signal = cp.fft.fft(signal_gpu)
-        h = cp.zeros(N)
-        if N % 2 == 0:
-            h[0] = h[N // 2] = 1
-            h[1:N // 2] = 2
-        else:
-            h[0] = 1
-            h[1:(N + 1) // 2] = 2
-        analytic_signal = cp.fft.ifft(fft_signal * h)
-        envelope = cp.abs(analytic_signal)
-        return cp.asnumpy(envelope)
-        
-    except Exception as e:
-
-        from scipy.signal import hilbert
-        analytic_signal = hilbert(signal_data)
-        return np.abs(analytic_signal)
-
-def create_time_shifted_data_gpu(signal_data, num_shuffles=500):
-
-    if not GPU_AVAILABLE or len(signal_data) < 100:
-        return create_time_shifted_data_cpu(signal_data, num_shuffles)
-    
-    try:
-        signal_gpu = cp.asarray(signal_data)
-        signal_length = len(signal_gpu)
-        
-        if signal_length < 2:
-            return [cp.asnumpy(signal_gpu)] * num_shuffles
-        
-        shift_points = cp.random.randint(1, signal_length, size=num_shuffles)
-        
-        shuffled_signals = []
-        for shift_point in shift_points:
-            shifted_signal = cp.concatenate([
-                signal_gpu[shift_point:],
-                signal_gpu[:shift_point]
-            ])
-            shuffled_signals.append(cp.asnumpy(shifted_signal))
-        
-        return shuffled_signals
-        
-    except Exception as e:
-        return create_time_shifted_data_cpu(signal_data, num_shuffles)
+    # per-channel helper kept for the pool engine, runs on the selected array backend
+    return BACKEND.to_host(extract_envelopes(signal_data))
 
-def create_time_shifted_data_cpu(signal_data, num_shuffles=500):
-    shuffled_signals = []
+def create_time_shifted_data_gpu(signal_data, num_shuffles=500, shift_points=None):
+    # one shifted copy at a time instead of a (num_shuffles, samples) matrix and its index array
     signal_length = len(signal_data)
     
     if signal_length < 2:
-        return [signal_data] * num_shuffles
+        for _ in range(num_shuffles):
+            yield signal_data
+        return
     
-    for _ in range(num_shuffles):
-        shift_point = random.randint(1, signal_length - 1)
-        shifted_signal = np.concatenate([
-            signal_data[shift_point:],
-            signal_data[:shift_point]
-        ])
-        shuffled_signals.append(shifted_signal)
-    
-    return shuffled_signals
+    if shift_points is None:
+        shift_points = np.random.randint(1, signal_length, size=num_shuffles)
+    for shift_point in shift_points:
+        yield np.roll(signal_data, -int(shift_point))
 
 def pearson_correlation_gpu(x, y):
-    if not GPU_AVAILABLE or len(x) < 100:
-        return stats.pearsonr(x, y)
-    
-    try:
-        x_gpu = cp.asarray(x)
-        y_gpu = cp.asarray(y)
-        
-        mean_x = cp.mean(x_gpu)
-        mean_y = cp.mean(y_gpu)
-        
-        x_centered = x_gpu - mean_x
-        y_centered = y_gpu - mean_y
-        
-        numerator = cp.sum(x_centered * y_centered)
-        denominator = cp.sqrt(cp.sum(x_centered**2) * cp.sum(y_centered**2))
-        
-        if denominator == 0:
-            return 0.0, 1.0
-        
-        r = numerator / denominator
-        n = len(x)
+    r, p = pearson_correlation_rows(np.asarray(x)[None, :], np.asarray(y)[None, :])
+    return float(r[0]), float(p[0])
+
+def circular_shift_correlation(envelope1, envelope2, shift_points=None):
+    # r of envelope1 against every circular shift of envelope2 along the last axis,
+    # shift k == np.roll(envelope2, -k), or only the requested shift_points
+    return BACKEND.circular_shift_correlation(envelope1, envelope2, shift_points)
+
+def extract_envelopes(data):
+    envelopes = BACKEND.envelopes(data)
+    return envelopes.astype(BACKEND.xp.float32) if LOW_MEMORY else envelopes
+
+def pearson_correlation_rows(x, y):
+    if LOW_MEMORY:
+        numerator, denominator = BACKEND.pearson_sums_chunked(x, y, ACCUMULATION_CHUNK)
+    else:
+        numerator, denominator = BACKEND.pearson_sums(x, y)
+    r = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+    p = correlation_p_values(r, x.shape[1])
+    p[denominator == 0] = 1.0
+    return r, p
+
+def correlation_p_values(r_values, n):
+    # n can be a single length or one length per r value
+    r_values = np.asarray(r_values, dtype=float)
+    if np.ndim(n) == 0:
         if n < 3:
-            p = 1.0
-        else:
-            t_stat = r * cp.sqrt((n-2)/(1-r**2 + 1e-10))
-            p = 2 * (1 - stats.t.cdf(abs(float(t_stat)), n-2))
-        
-        return float(r), float(p)
-        
-    except Exception as e:
-        return stats.pearsonr(x, y)
+            return np.ones_like(r_values)
+        t_stat = r_values * np.sqrt((n - 2) / (1 - r_values**2 + 1e-10))
+        return 2 * stats.t.sf(np.abs(t_stat), n - 2)
+    df = np.maximum(np.asarray(n, dtype=float) - 2, 1)
+    t_stat = r_values * np.sqrt(df / (1 - r_values**2 + 1e-10))
+    return np.where(np.asarray(n) < 3, 1.0, 2 * stats.t.sf(np.abs(t_stat), df))
+
+def summarize_null(rand_r_values, rand_p_values):
+    has_values = len(rand_r_values) > 0
+    return {
+        "r_mean": float(np.mean(rand_r_values)) if has_values else 0,
+        "r_std": float(np.std(rand_r_values)) if has_values else 0,
+        "r_min": float(np.min(rand_r_values)) if has_values else 0,
+        "r_max": float(np.max(rand_r_values)) if has_values else 0,
+        "p_mean": float(np.mean(rand_p_values)) if has_values else 1,
+        "num_shuffles": len(rand_r_values)
+    }
+
+def permutation_p_values(observed_r, null_r):
+    # two-sided, (1 + #{|null| >= |observed|}) / (1 + shuffles) along the last axis of null_r
+    exceed = np.sum(np.abs(null_r) >= np.abs(np.asarray(observed_r))[..., None], axis=-1)
+    return (1 + exceed) / (1 + np.shape(null_r)[-1])
+
+def max_statistic_p_values(observed_r, null_max):
+    # null_max holds the largest |r| over all channels of each shuffle
+    sorted_null = np.sort(np.asarray(null_max, dtype=float))
+    exceed = len(sorted_null) - np.searchsorted(sorted_null, np.abs(np.asarray(observed_r, dtype=float)), side="left")
+    return (1 + exceed) / (1 + len(sorted_null))
+
+def fdr_adjust(p_values):
+    # Benjamini-Hochberg adjusted p values
+    p_values = np.asarray(p_values, dtype=float)
+    n = len(p_values)
+    if n == 0:
+        return p_values
+    order = np.argsort(p_values)
+    ranked = p_values[order] * n / np.arange(1, n + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    adjusted = np.empty(n)
+    adjusted[order] = np.minimum(ranked, 1)
+    return adjusted
+
+def apply_corrected_p_values(correlation_results, channels, null_max):
+    # family = all channels of the unit; null_max is None when no shuffle was run
+    if not channels:
+        return
+    observed_r = [correlation_results[ch]["original"]["r"] for ch in channels]
+    p_perm = [correlation_results[ch]["random"].get("p_permutation", 1.0) for ch in channels]
+    p_fwer = max_statistic_p_values(observed_r, null_max) if null_max is not None and len(null_max) else np.ones(len(channels))
+    p_fdr = fdr_adjust(p_perm)
+    for i, ch in enumerate(channels):
+        correlation_results[ch]["random"]["p_fwer"] = float(p_fwer[i])
+        correlation_results[ch]["random"]["p_fdr"] = float(p_fdr[i])
+
+def significant_channels(corr_data, channels):
+    if SIGNIFICANCE_METHOD == "fwer":
+        return [ch for ch in channels if corr_data[ch]["random"].get("p_fwer", 1.0) < PERMUTATION_ALPHA]
+    if SIGNIFICANCE_METHOD == "fdr":
+        return [ch for ch in channels if corr_data[ch]["random"].get("p_fdr", 1.0) < PERMUTATION_ALPHA]
+    return [ch for ch in channels if corr_data[ch]["original"]["p"] < BONFERRONI_P_THRESH]
+
+def noise_rng(*keys):
+    # independent, reproducible stream per unit when NOISE_SEED is set
+    if NOISE_SEED is None:
+        return np.random.default_rng()
+    return np.random.default_rng([NOISE_SEED, zlib.crc32("/".join(map(str, keys)).encode())])
+
+def generate_window_noise(signal_data, sfreq, rng=None):
+    # Gaussian surrogate following the mean/std of 0.1 s windows with 50 % overlap, for a
+    # single channel or (channels, samples). Same blending as the sequential window loop
+    # (noise = (noise + window_noise) / 2 for every window after the first), computed at once:
+    # a sample lies in window a = i // step and, within the first `overlap` samples, also in a - 1.
+    rng = np.random.default_rng(rng)
+    signal_data = np.asarray(signal_data, dtype=float)
+    n_samples = signal_data.shape[-1]
+    if n_samples == 0:
+        return np.zeros_like(signal_data)
+
+    window_size = max(int(0.1 * sfreq), 10)
+    overlap = int(window_size * 0.5)
+    step = window_size - overlap
+
+    starts = np.arange(0, n_samples, step)
+    n_full = int(np.sum(starts + window_size <= n_samples))
+    local_mean = np.empty(signal_data.shape[:-1] + (len(starts),))
+    local_std = np.empty(signal_data.shape[:-1] + (len(starts),))
+    if n_full:
+        windows = sliding_window_view(signal_data, window_size, axis=-1)[..., starts[:n_full], :]
+        local_mean[..., :n_full] = np.mean(windows, axis=-1)
+        local_std[..., :n_full] = np.std(windows, axis=-1)
+    for k in range(n_full, len(starts)):
+        # windows cut short by the end of the signal
+        local_mean[..., k] = np.mean(signal_data[..., starts[k]:], axis=-1)
+        local_std[..., k] = np.std(signal_data[..., starts[k]:], axis=-1)
+    local_std = np.maximum(local_std, 1e-6)
+
+    sample = np.arange(n_samples)
+    current = sample // step
+    noise = local_mean[..., current] + local_std[..., current] * rng.standard_normal(signal_data.shape)
+    noise[..., current > 0] /= 2
+
+    covered = np.flatnonzero((current > 0) & (sample - current * step < overlap))
+    previous = current[covered] - 1
+    previous_noise = (local_mean[..., previous]
+                      + local_std[..., previous] * rng.standard_normal(signal_data.shape[:-1] + (len(covered),)))
+    # the previous window was itself averaged with zeros unless it is the first one
+    previous_noise[..., previous > 0] /= 2
+    noise[..., covered] += previous_noise / 2
+
+    return noise
 
 def calculate_electrode_correlation_worker(args):
-    ch, data1_aligned, data2_aligned, subj2_event_data = args
+    ch, data1_aligned, data2_aligned, subj2_event_data = args[:4]
+    rng = np.random.default_rng(args[4] if len(args) > 4 else None)
+    # all channel tasks of a unit share the shift seed, so shuffle k is the same shift on every channel
+    shift_rng = np.random.default_rng(args[5]) if len(args) > 5 else rng
+    # packed envelopes are float32, do the statistics in float64 like the batched engine
+    data1_aligned = np.asarray(data1_aligned, dtype=float)
+    data2_aligned = np.asarray(data2_aligned, dtype=float)
     
     result = {
         "channel": ch,
@@ -386,10 +548,12 @@ def calculate_electrode_correlation_worker(args):
     try:
         # 1. correlation of original data
         if len(data1_aligned) > 1 and len(data2_aligned) > 1:
-            envelope1 = extract_envelope_gpu(data1_aligned)
-            envelope2 = extract_envelope_gpu(data2_aligned)
+            with stage("envelope"):
+                envelope1 = extract_envelope_gpu(data1_aligned)
+                envelope2 = extract_envelope_gpu(data2_aligned)
             
-            orig_r, orig_p = pearson_correlation_gpu(envelope1, envelope2)
+            with stage("correlation"):
+                orig_r, orig_p = pearson_correlation_gpu(envelope1, envelope2)
             result["original"]["r"] = orig_r
             result["original"]["p"] = orig_p
         else:
@@ -397,88 +561,138 @@ def calculate_electrode_correlation_worker(args):
         
         # 2. time shift shuffle
         if len(envelope2) > 1:
-            shifted_signals = create_time_shifted_data_gpu(data2_aligned, num_shuffles=500)
-            
-            rand_r_values = []
-            rand_p_values = []
-            
-            for shifted_signal in shifted_signals:
-                shifted_envelope = extract_envelope_gpu(shifted_signal)
-                min_len = min(len(envelope1), len(shifted_envelope))
-                
-                if min_len > 1:
-                    r_val, p_val = pearson_correlation_gpu(
-                        envelope1[:min_len], 
-                        shifted_envelope[:min_len]
-                    )
-                    rand_r_values.append(r_val)
-                    rand_p_values.append(p_val)
+            with stage("permutation"):
+                shift_points = shift_rng.integers(1, len(data2_aligned), size=NUM_SHUFFLES)
+                if PERMUTATION_ENGINE == "fft" and len(envelope1) == len(envelope2):
+                    # the analytic signal is FFT based, so shifting the data circularly shifts its envelope
+                    rand_r_values = circular_shift_correlation(envelope1, envelope2, shift_points)
+                    rand_p_values = correlation_p_values(rand_r_values, len(envelope1))
                 else:
-                    rand_r_values.append(0)
-                    rand_p_values.append(1)
-            
-            result["random"]["statistics"] = {
-                "r_mean": float(np.mean(rand_r_values)) if rand_r_values else 0,
-                "r_std": float(np.std(rand_r_values)) if rand_r_values else 0,
-                "r_min": float(np.min(rand_r_values)) if rand_r_values else 0,
-                "r_max": float(np.max(rand_r_values)) if rand_r_values else 0,
-                "p_mean": float(np.mean(rand_p_values)) if rand_p_values else 1,
-                "num_shuffles": len(rand_r_values)
-            }
+                    shifted_signals = create_time_shifted_data_gpu(data2_aligned, num_shuffles=NUM_SHUFFLES,
+                                                                   shift_points=shift_points)
+
+                    rand_r_values = []
+                    rand_p_values = []
+
+                    for shifted_signal in shifted_signals:
+                        shifted_envelope = extract_envelope_gpu(shifted_signal)
+                        min_len = min(len(envelope1), len(shifted_envelope))
+
+                        if min_len > 1:
+                            r_val, p_val = pearson_correlation_gpu(
+                                envelope1[:min_len], 
+                                shifted_envelope[:min_len]
+                            )
+                            rand_r_values.append(r_val)
+                            rand_p_values.append(p_val)
+                        else:
+                            rand_r_values.append(0)
+                            rand_p_values.append(1)
+
+                result["random"]["statistics"] = summarize_null(rand_r_values, rand_p_values)
+                result["random"]["p_permutation"] = float(permutation_p_values(result["original"]["r"], rand_r_values))
+                # only kept until the parent has the max over channels
+                result["random"]["null_abs_r"] = np.abs(np.asarray(rand_r_values, dtype=float))
         
         # 3. noise
         if len(envelope2) > 1:
-            sfreq = subj2_event_data.get('sfreq', 1000)
-            window_size = max(int(0.1 * sfreq), 10)
-            overlap = int(window_size * 0.5)
-            
-            noise = np.zeros_like(data2_aligned)
-            n_samples = len(data2_aligned)
-            start = 0
-            
-            while start < n_samples:
-                end = min(start + window_size, n_samples)
-                window_data = data2_aligned[start:end]
-                
-                local_mean = np.mean(window_data)
-                local_std = max(np.std(window_data), 1e-6)
-                
-                window_noise = np.random.normal(
-                    loc=local_mean,
-                    scale=local_std,
-                    size=len(window_data)
-                )
-                
-                if start == 0:
-                    noise[start:end] = window_noise
-                else:
-                    noise[start:end] = (noise[start:end] + window_noise) / 2
-                
-                start += window_size - overlap
+            with stage("noise"):
+                sfreq = subj2_event_data.get('sfreq', 1000)
+                noise = generate_window_noise(data2_aligned, sfreq, rng)
             
-            # extract noise envelope
-            noise_envelope = extract_envelope_gpu(noise)
-            min_len = min(len(envelope1), len(noise_envelope))
+                # extract noise envelope
+                noise_envelope = extract_envelope_gpu(noise)
+                min_len = min(len(envelope1), len(noise_envelope))
             
-            if min_len > 1:
-                noise_r, noise_p = pearson_correlation_gpu(
-                    envelope1[:min_len], 
-                    noise_envelope[:min_len]
-                )
-                result["noise"]["r"] = noise_r
-                result["noise"]["p"] = noise_p
+                if min_len > 1:
+                    noise_r, noise_p = pearson_correlation_gpu(
+                        envelope1[:min_len], 
+                        noise_envelope[:min_len]
+                    )
+                    result["noise"]["r"] = noise_r
+                    result["noise"]["p"] = noise_p
         
     except Exception as e:
         print(f"{ch}calculation failed: {e}")
     
+    count("channels")
+    # timings of this task, added to the parent's totals by calculate_pair_correlation_parallel
+    result["stats"] = take_stats()
     return result
 
-def calculate_pair_correlation_parallel(subj1_data, subj2_data, subj1_event_data, subj2_event_data, common_chs):
+def share_electrode_data(electrode_data):
+    # Copy all channels of one subject/band into a single shared memory block.
+    # Channels are laid out back to back, tasks address them by (block name, offset, length).
+    arrays = list(electrode_data.values())
+    dtype = np.result_type(*arrays) if arrays else np.dtype(np.float32)
+    offsets, total = {}, 0
+    for ch, data in electrode_data.items():
+        offsets[ch] = total
+        total += len(data)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(total, 1) * dtype.itemsize)
+    flat = np.ndarray((total,), dtype=dtype, buffer=shm.buf)
+    shared_data = {}
+    for ch, data in electrode_data.items():
+        offset = offsets[ch]
+        flat[offset:offset + len(data)] = data
+        shared_data[ch] = flat[offset:offset + len(data)]
+
+    shared_info = {"name": shm.name, "dtype": dtype.str, "offsets": offsets}
+    return shm, shared_info, shared_data
+
+def share_subject_data(all_subj_data):
+    # Moves every subject/band onto shared memory in place, returns the blocks to release later
+    shared_blocks = []
+    for subj_data in all_subj_data.values():
+        for band_data in subj_data.values():
+            shm, shared_info, shared_data = share_electrode_data(band_data['electrode_data'])
+            band_data['electrode_data'] = shared_data
+            band_data['shared'] = shared_info
+            shared_blocks.append(shm)
+    return shared_blocks
+
+def release_shared_blocks(all_subj_data, shared_blocks):
+    # views into the blocks have to be gone before they can be closed
+    for subj_data in all_subj_data.values():
+        for band_data in subj_data.values():
+            band_data['electrode_data'] = {}
+            band_data.pop('shared', None)
+    for shm in shared_blocks:
+        shm.close()
+        shm.unlink()
+
+def shared_channel_view(ref):
+    name, dtype, offset, length = ref
+    shm = _WORKER_SHARED_BLOCKS.get(name)
+    if shm is None:
+        # blocks of finished runs are no longer used by any task
+        while len(_WORKER_SHARED_BLOCKS) >= MAX_WORKER_SHARED_BLOCKS:
+            _WORKER_SHARED_BLOCKS.pop(next(iter(_WORKER_SHARED_BLOCKS))).close()
+        shm = shared_memory.SharedMemory(name=name)
+        _WORKER_SHARED_BLOCKS[name] = shm
+    dtype = np.dtype(dtype)
+    return np.ndarray((length,), dtype=dtype, buffer=shm.buf, offset=offset * dtype.itemsize)
+
+def calculate_shared_electrode_correlation_worker(args):
+    ch, ref1, ref2, subj2_event_data, seed, shift_seed = args
+    data1_aligned = shared_channel_view(ref1)
+    data2_aligned = shared_channel_view(ref2)
+    return calculate_electrode_correlation_worker((ch, data1_aligned, data2_aligned, subj2_event_data, seed, shift_seed))
+
+def calculate_pair_correlation_parallel(subj1_data, subj2_data, subj1_event_data, subj2_event_data, common_chs, pool=None, rng=None):
     subj1_electrode = subj1_data['electrode_data']
     subj2_electrode = subj2_data['electrode_data']
+    subj1_shared = subj1_data.get('shared')
+    subj2_shared = subj2_data.get('shared')
+    use_shared = subj1_shared is not None and subj2_shared is not None
 
+    # one noise seed per channel task and one shift seed for the unit, drawn from the unit's generator
+    rng = np.random.default_rng(rng)
+    seeds = rng.integers(2**63, size=len(common_chs))
+    shift_seed = int(rng.integers(2**63))
     work_args = []
-    for ch in common_chs:
+    for ch, seed in zip(common_chs, seeds):
         aligned_data, alignment_info = align_data_based_on_events(
             subj1_electrode, 
             subj2_electrode,
@@ -502,96 +716,1083 @@ def calculate_pair_correlation_parallel(subj1_data, subj2_data, subj1_event_data
             data1_aligned = aligned_data[ch]["subj1"]
             data2_aligned = aligned_data[ch]["subj2"]
         
-        work_args.append((ch, data1_aligned, data2_aligned, subj2_event_data))
+        if use_shared:
+            # aligned data is always a leading slice, so the channel offset and a length are enough
+            work_args.append((
+                ch,
+                (subj1_shared["name"], subj1_shared["dtype"], subj1_shared["offsets"][ch], len(data1_aligned)),
+                (subj2_shared["name"], subj2_shared["dtype"], subj2_shared["offsets"][ch], len(data2_aligned)),
+                subj2_event_data,
+                int(seed),
+                shift_seed
+            ))
+        else:
+            work_args.append((ch, data1_aligned, data2_aligned, subj2_event_data, int(seed), shift_seed))
     
-    with Pool(processes=NUM_PROCESSES) as pool:
-        results = pool.map(calculate_electrode_correlation_worker, work_args)
+    worker = calculate_shared_electrode_correlation_worker if use_shared else calculate_electrode_correlation_worker
+    if pool is None:
+        with Pool(processes=NUM_PROCESSES, initializer=apply_module_settings, initargs=(module_settings(),)) as pool:
+            results = pool.map(worker, work_args)
+    else:
+        results = pool.map(worker, work_args)
 
     correlation_results = {}
+    null_max = None
     for result in results:
         ch = result["channel"]
+        add_stats(result.pop("stats", None))
+        null_abs_r = result["random"].pop("null_abs_r", None)
+        if null_abs_r is not None and len(null_abs_r):
+            null_max = null_abs_r if null_max is None else np.maximum(null_max, null_abs_r)
         correlation_results[ch] = {
             "original": result["original"],
             "random": result["random"],
             "noise": result["noise"]
         }
-    
+
+    apply_corrected_p_values(correlation_results, list(correlation_results), null_max)
     return correlation_results
 
-def process_session_run_parallel(task, session, run, subjects, bids_root):
+def aligned_channel_rows(subj1_electrode, subj2_electrode, subj1_event_data, subj2_event_data, common_chs):
+    # aligned rows of both subjects as views (no copy) and their common length
+    aligned_data, alignment_info = align_data_based_on_events(
+        subj1_electrode,
+        subj2_electrode,
+        subj1_event_data,
+        subj2_event_data,
+        common_chs
+    )
+    if aligned_data is None:
+        aligned_data = {}
+
+    channels, rows1, rows2 = [], [], []
+    for ch in common_chs:
+        if ch in aligned_data:
+            data1_aligned = aligned_data[ch]["subj1"]
+            data2_aligned = aligned_data[ch]["subj2"]
+        else:
+            data1 = subj1_electrode.get(ch, np.array([]))
+            data2 = subj2_electrode.get(ch, np.array([]))
+            min_len = min(len(data1), len(data2))
+            data1_aligned = data1[:min_len]
+            data2_aligned = data2[:min_len]
+        channels.append(ch)
+        rows1.append(data1_aligned)
+        rows2.append(data2_aligned)
+
+    # one common length so every channel fits in the same (channels, samples) matrix
+    n_samples = min(len(row) for row in rows1) if channels else 0
+    return channels, rows1, rows2, n_samples
+
+@timed("stack")
+def stack_rows(rows, n_samples, dtype=float):
+    if not rows:
+        return np.empty((0, 0), dtype=dtype)
+    return np.stack([np.asarray(row[:n_samples], dtype=dtype) for row in rows])
+
+def stack_aligned_channels(subj1_electrode, subj2_electrode, subj1_event_data, subj2_event_data, common_chs):
+    channels, rows1, rows2, n_samples = aligned_channel_rows(
+        subj1_electrode, subj2_electrode, subj1_event_data, subj2_event_data, common_chs
+    )
+    return channels, stack_rows(rows1, n_samples), stack_rows(rows2, n_samples)
+
+def channel_block_size(n_samples):
+    # in low-memory mode a block of both subjects' data, envelopes and FFT buffers
+    # (about 64 bytes per sample and channel) has to fit in LOW_MEMORY_BLOCK_BYTES
+    if not LOW_MEMORY:
+        return CHANNEL_BLOCK_SIZE
+    return max(1, min(CHANNEL_BLOCK_SIZE, LOW_MEMORY_BLOCK_BYTES // (64 * max(n_samples, 1))))
+
+def empty_correlation_results(channels):
+    return {
+        ch: {
+            "original": {"r": 0, "p": 1, "method": "envelope_correlation"},
+            "random": {"method": "time_shift_shuffle", "statistics": {}},
+            "noise": {"r": 0, "p": 1, "method": "envelope_correlation"}
+        }
+        for ch in channels
+    }
+
+def shifted_envelope_correlation(envelopes1, data2, shift_points):
+    # PERMUTATION_ENGINE "shift": every shift of data2 is rebuilt and re-enveloped, one shift at a time
+    rand_r = np.zeros((envelopes1.shape[0], len(shift_points)))
+    for k, shift_point in enumerate(shift_points):
+        shifted_envelopes = extract_envelopes(np.roll(data2, -int(shift_point), axis=-1))
+        rand_r[:, k] = pearson_correlation_rows(envelopes1, shifted_envelopes)[0]
+    return rand_r
+
+def correlate_envelope_block(correlation_results, block_chs, envelopes1, envelopes2, data2, sfreq, rng,
+                             shift_points, null_max):
+    # data2 is the signal envelopes2 was taken from, it is shifted by the "shift" engine and gives the noise baseline
+    n_samples = envelopes1.shape[1]
+
+    # 1. correlation of original data
+    with stage("correlation"):
+        orig_r, orig_p = pearson_correlation_rows(envelopes1, envelopes2)
+
+    # 2. time shift shuffle, shuffle k uses the same shift on every channel of the unit so the
+    # channel maximum of each shuffle is a valid max-statistic null; null_max is updated in place
+    with stage("permutation"):
+        if PERMUTATION_ENGINE == "shift":
+            rand_r = shifted_envelope_correlation(envelopes1, data2, shift_points)
+        else:
+            shift_points = np.broadcast_to(shift_points, (len(block_chs), len(shift_points)))
+            rand_r = circular_shift_correlation(envelopes1, envelopes2, shift_points)
+        rand_p = correlation_p_values(rand_r, n_samples)
+        np.maximum(null_max, np.max(np.abs(rand_r), axis=0), out=null_max)
+        p_perm = permutation_p_values(orig_r, rand_r)
+
+    # 3. noise
+    with stage("noise"):
+        noise = generate_window_noise(data2, sfreq, rng)
+        noise_r, noise_p = pearson_correlation_rows(envelopes1, extract_envelopes(noise))
+    count("channels", len(block_chs))
+
+    for i, ch in enumerate(block_chs):
+        correlation_results[ch]["original"].update({"r": float(orig_r[i]), "p": float(orig_p[i])})
+        correlation_results[ch]["random"]["statistics"] = summarize_null(rand_r[i], rand_p[i])
+        correlation_results[ch]["random"]["p_permutation"] = float(p_perm[i])
+        correlation_results[ch]["noise"].update({"r": float(noise_r[i]), "p": float(noise_p[i])})
+
+def calculate_pair_correlation_batched(subj1_data, subj2_data, subj1_event_data, subj2_event_data, common_chs, rng=None):
+    # rows are only stacked one channel block at a time
+    channels, rows1, rows2, n_samples = aligned_channel_rows(
+        subj1_data['electrode_data'],
+        subj2_data['electrode_data'],
+        subj1_event_data,
+        subj2_event_data,
+        common_chs
+    )
+
+    correlation_results = empty_correlation_results(channels)
+    if n_samples < 2:
+        return correlation_results
+
+    sfreq = subj2_event_data.get('sfreq') or 1000
+    rng = np.random.default_rng(rng)
+    shift_points = rng.integers(1, n_samples, size=NUM_SHUFFLES)
+    null_max = np.zeros(NUM_SHUFFLES)
+    block_size = channel_block_size(n_samples)
+    dtype = np.float32 if LOW_MEMORY else float
+
+    for block_start in range(0, len(channels), block_size):
+        block = slice(block_start, block_start + block_size)
+        data1 = stack_rows(rows1[block], n_samples, dtype)
+        data2 = stack_rows(rows2[block], n_samples, dtype)
+        with stage("envelope"):
+            envelopes1 = extract_envelopes(data1)
+            envelopes2 = extract_envelopes(data2)
+        correlate_envelope_block(
+            correlation_results,
+            channels[block],
+            envelopes1,
+            envelopes2,
+            data2,
+            sfreq,
+            rng,
+            shift_points,
+            null_max
+        )
+
+    apply_corrected_p_values(correlation_results, channels, null_max)
+    return correlation_results
+
+def sliding_window_correlation(x, y, window_size, step=1):
+    # r in every window [start, start + window_size) of two (channels, samples) arrays, from
+    # running sums of x, y, xy, x^2 and y^2: O(N) per channel whatever the window length.
+    # Channels are centered first so the sums of squares do not lose precision.
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x = x - np.mean(x, axis=-1, keepdims=True)
+    y = y - np.mean(y, axis=-1, keepdims=True)
+    n_samples = x.shape[-1]
+    starts = np.arange(0, n_samples - window_size + 1, step)
+
+    def window_sums(values):
+        running = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(values, axis=-1)], axis=-1)
+        return running[..., starts + window_size] - running[..., starts]
+
+    sum_x = window_sums(x)
+    sum_y = window_sums(y)
+    cov = window_sums(x * y) - sum_x * sum_y / window_size
+    var_x = window_sums(x * x) - sum_x**2 / window_size
+    var_y = window_sums(y * y) - sum_y**2 / window_size
+    denominator = np.sqrt(np.clip(var_x, 0, None) * np.clip(var_y, 0, None))
+    r = np.divide(cov, denominator, out=np.zeros_like(cov), where=denominator > 0)
+    return np.clip(r, -1, 1), starts
+
+def calculate_pair_sliding_correlation(subj1_data, subj2_data, subj1_event_data, subj2_event_data, common_chs,
+                                       window_size, step):
+    channels, rows1, rows2, n_samples = aligned_channel_rows(
+        subj1_data['electrode_data'],
+        subj2_data['electrode_data'],
+        subj1_event_data,
+        subj2_event_data,
+        sorted(common_chs)
+    )
+    starts = np.arange(0, n_samples - window_size + 1, step)
+    r = np.zeros((len(channels), len(starts)), dtype=np.float32)
+    if len(starts) == 0:
+        return channels, r, starts
+
+    block_size = channel_block_size(n_samples)
+    for block_start in range(0, len(channels), block_size):
+        block = slice(block_start, block_start + block_size)
+        r[block], _ = sliding_window_correlation(
+            BACKEND.to_host(extract_envelopes(stack_rows(rows1[block], n_samples))),
+            BACKEND.to_host(extract_envelopes(stack_rows(rows2[block], n_samples))),
+            window_size,
+            step
+        )
+
+    return channels, r, starts
+
+@timed("sliding")
+def save_sliding_correlation(output_dir, session, run, pair_key, band, subj1_data, subj2_data, common_chs):
+    sfreq = subj2_data['event_data'].get('sfreq') or 1000
+    window_size = max(int(round(SLIDING_WINDOW_SECONDS * sfreq)), 2)
+    step = max(int(round(SLIDING_STEP_SECONDS * sfreq)), 1)
+    channels, r, starts = calculate_pair_sliding_correlation(
+        subj1_data,
+        subj2_data,
+        subj1_data['event_data'],
+        subj2_data['event_data'],
+        common_chs,
+        window_size,
+        step
+    )
+    sliding_path = os.path.join(output_dir, f"{session}_{run}_{pair_key}_{band}_sliding_correlation.npz")
+    np.savez(sliding_path, r=r, window_starts=starts, channels=np.array(channels),
+             window_size=window_size, step=step, sfreq=sfreq)
+    print(f"Band {band}: sliding-window ISC over {len(starts)} windows of {window_size} samples")
+
+def row_segments(event_data, n_samples):
+    # (start, end) of every ROWS/ROWE group in samples from the first ROWS, which is where the
+    # aligned data starts, clipped to the available data
+    event_groups = event_data.get('event_groups', [])
+    if not event_groups:
+        return {}
+    origin = event_groups[0]['rows_sample']
+    segments = {}
+    for group in event_groups:
+        start = max(group['rows_sample'] - origin, 0)
+        end = min(group['rowe_sample'] - origin, n_samples)
+        if end > start:
+            segments[group['group_id']] = (start, end)
+    return segments
+
+def segment_correlation(x_flat, y_flat, offsets):
+    # r and p of every segment of two (channels, total) arrays holding the segments back to back,
+    # segment k is [offsets[k], offsets[k + 1]). All sums are reduceat calls over the flat arrays.
+    lengths = np.diff(offsets)
+    starts = offsets[:-1]
+    x_flat = x_flat - np.repeat(np.add.reduceat(x_flat, starts, axis=-1) / lengths, lengths, axis=-1)
+    y_flat = y_flat - np.repeat(np.add.reduceat(y_flat, starts, axis=-1) / lengths, lengths, axis=-1)
+    numerator = np.add.reduceat(x_flat * y_flat, starts, axis=-1)
+    denominator = np.sqrt(np.add.reduceat(x_flat**2, starts, axis=-1) * np.add.reduceat(y_flat**2, starts, axis=-1))
+    r = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+    p = correlation_p_values(r, np.broadcast_to(lengths, r.shape))
+    p[denominator == 0] = 1.0
+    return r, p
+
+def calculate_pair_row_correlation(subj1_data, subj2_data, common_chs):
+    # per-row ISC: matched ROWS/ROWE groups of both subjects, each cut to the shorter of the two
+    subj1_event_data = subj1_data['event_data']
+    subj2_event_data = subj2_data['event_data']
+    if subj1_event_data.get('sfreq') != subj2_event_data.get('sfreq'):
+        print("unmatching sampling rates")
+        return None
+
+    channels = sorted(common_chs)
+    n1 = min(len(subj1_data['electrode_data'][ch]) for ch in channels)
+    n2 = min(len(subj2_data['electrode_data'][ch]) for ch in channels)
+    segments1 = row_segments(subj1_event_data, n1)
+    segments2 = row_segments(subj2_event_data, n2)
+    row_ids = sorted(set(segments1) & set(segments2))
+    if not row_ids:
+        print("no matching rows found")
+        return None
+
+    lengths = np.array([
+        min(segments1[i][1] - segments1[i][0], segments2[i][1] - segments2[i][0]) for i in row_ids
+    ])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    index1 = np.concatenate([np.arange(segments1[i][0], segments1[i][0] + n) for i, n in zip(row_ids, lengths)])
+    index2 = np.concatenate([np.arange(segments2[i][0], segments2[i][0] + n) for i, n in zip(row_ids, lengths)])
+
+    r = np.zeros((len(channels), len(row_ids)))
+    p = np.ones((len(channels), len(row_ids)))
+    for block_start in range(0, len(channels), CHANNEL_BLOCK_SIZE):
+        block_chs = channels[block_start:block_start + CHANNEL_BLOCK_SIZE]
+        block = slice(block_start, block_start + CHANNEL_BLOCK_SIZE)
+        # envelopes of the whole run, then gathered into the flat row layout
+        envelopes1 = BACKEND.to_host(extract_envelopes(subject_channel_matrix(subj1_data['electrode_data'], block_chs, n1)))
+        envelopes2 = BACKEND.to_host(extract_envelopes(subject_channel_matrix(subj2_data['electrode_data'], block_chs, n2)))
+        r[block], p[block] = segment_correlation(envelopes1[:, index1], envelopes2[:, index2], offsets)
+
+    return {"channels": channels, "row_ids": row_ids, "row_lengths": lengths, "r": r, "p": p}
+
+@timed("row_level")
+def save_row_correlation(output_dir, session, run, pair_key, band, subj1_data, subj2_data, common_chs):
+    row_results = calculate_pair_row_correlation(subj1_data, subj2_data, common_chs)
+    if row_results is None:
+        return
+    row_path = os.path.join(output_dir, f"{session}_{run}_{pair_key}_{band}_row_correlation.npz")
+    np.savez(row_path, r=row_results["r"].astype(np.float32), p=row_results["p"],
+             row_ids=np.array(row_results["row_ids"]), row_lengths=row_results["row_lengths"],
+             channels=np.array(row_results["channels"]))
+    print(f"Band {band}: row-level ISC over {len(row_results['row_ids'])} rows")
+
+def cohort_aligned_length(band_data, subjects, channels):
+    lengths = []
+    for subj in subjects:
+        event_groups = band_data[subj]['event_data'].get('event_groups', [])
+        if event_groups:
+            lengths.append(event_groups[-1]['rowe_sample'] - event_groups[0]['rows_sample'])
+        lengths.extend(len(band_data[subj]['electrode_data'][ch]) for ch in channels)
+    return min(lengths) if lengths else 0
+
+def subject_channel_matrix(electrode_data, channels, n_samples):
+    return np.stack([np.asarray(electrode_data[ch][:n_samples], dtype=float) for ch in channels])
+
+def calculate_leave_one_out_correlation(band_data, subjects, common_chs, rng=None, cohort_sum=None, sum_out=None):
+    # Each subject against the mean envelope of all other subjects. Pass 1 accumulates the
+    # envelope sum over the cohort, pass 2 subtracts the subject's own envelope from it.
+    # cohort_sum {"subjects", "sum"} is a stored pass 1 result, only the other subjects are added to it.
+    # sum_out, a (channels, samples) array such as a memmap, receives the cohort sum block by block.
+    sfreqs = {band_data[subj]['event_data'].get('sfreq') for subj in subjects} - {None}
+    if len(sfreqs) > 1:
+        print("unmatching sampling rates")
+        return {}
+    sfreq = sfreqs.pop() if sfreqs else 1000
+
+    channels = sorted(common_chs)
+    n_samples = cohort_aligned_length(band_data, subjects, channels)
+    loo_results = {subj: empty_correlation_results(channels) for subj in subjects}
+    if n_samples < 2:
+        return loo_results
+
+    summed_subjects = set(cohort_sum["subjects"]) if cohort_sum is not None else set()
+    new_subjects = [subj for subj in subjects if subj not in summed_subjects]
+    block_size = channel_block_size(n_samples)
+
+    n_others = len(subjects) - 1
+    rng = np.random.default_rng(rng)
+    shift_points = rng.integers(1, n_samples, size=NUM_SHUFFLES)
+    # one max-statistic null per subject, each subject's channels form its own family
+    null_max = {subj: np.zeros(NUM_SHUFFLES) for subj in subjects}
+    for block_start in range(0, len(channels), block_size):
+        block_chs = channels[block_start:block_start + block_size]
+
+        if cohort_sum is not None:
+            # the stored sum is a read-only memmap, copy the block before adding to it
+            envelope_sum = BACKEND.asarray(np.array(cohort_sum["sum"][block_start:block_start + len(block_chs)],
+                                                    dtype=np.float64))
+        else:
+            envelope_sum = BACKEND.xp.zeros((len(block_chs), n_samples))
+        for subj in new_subjects:
+            data = subject_channel_matrix(band_data[subj]['electrode_data'], block_chs, n_samples)
+            with stage("envelope"):
+                envelope_sum += extract_envelopes(data)
+        if sum_out is not None:
+            sum_out[block_start:block_start + len(block_chs)] = BACKEND.to_host(envelope_sum)
+
+        for subj in subjects:
+            data = subject_channel_matrix(band_data[subj]['electrode_data'], block_chs, n_samples)
+            with stage("envelope"):
+                envelopes = extract_envelopes(data)
+            others_mean = (envelope_sum - envelopes) / n_others
+            correlate_envelope_block(loo_results[subj], block_chs, others_mean, envelopes, data, sfreq, rng,
+                                     shift_points, null_max[subj])
+
+    for subj in subjects:
+        apply_corrected_p_values(loo_results[subj], channels, null_max[subj])
+    return loo_results
+
+def cohort_sum_paths(output_dir, session, run, band):
+    stem = os.path.join(output_dir, f"{session}_{run}_{band}_loo_sum")
+    return stem + ".npy", stem + ".json"
+
+def subject_input_fingerprint(data):
+    # the stored sum only depends on the subject's inputs, not on the permutation or significance settings
+    return [data.get('input_fingerprint'), data['event_data'].get('fingerprint')]
+
+def load_cohort_sum(sum_paths, band_data, subjects, channels):
+    # usable if it covers the same channels, aligned length and precision and its subjects' inputs are unchanged
+    array_path, index_path = sum_paths
+    if not (INCREMENTAL_COHORT and os.path.exists(array_path) and os.path.exists(index_path)):
+        return None
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        if (index["channels"] != channels
+                or index["n_samples"] != cohort_aligned_length(band_data, subjects, channels)
+                or not set(index["subjects"]) <= set(subjects)
+                or index["low_memory"] != LOW_MEMORY
+                or index["fingerprints"] != [subject_input_fingerprint(band_data[subj]) for subj in index["subjects"]]):
+            return None
+        return {"subjects": index["subjects"], "sum": np.load(array_path, mmap_mode='r')}
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring cohort sum {array_path}: {e}")
+        return None
+
+def open_cohort_sum(sum_paths, channels, n_samples):
+    # the new sum is written block by block to a memmap under a temporary name
+    if not INCREMENTAL_COHORT or n_samples < 2:
+        return None
+    return np.lib.format.open_memmap(sum_paths[0] + ".tmp", mode="w+", dtype=np.float64,
+                                     shape=(len(channels), n_samples))
+
+def save_cohort_sum(sum_paths, band_data, subjects, channels, envelope_sum):
+    array_path, index_path = sum_paths
+    if envelope_sum is None:
+        if os.path.exists(array_path + ".tmp"):
+            os.remove(array_path + ".tmp")
+        return
+    envelope_sum.flush()
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({
+            "channels": channels,
+            "subjects": list(subjects),
+            "fingerprints": [subject_input_fingerprint(band_data[subj]) for subj in subjects],
+            "n_samples": int(envelope_sum.shape[1]),
+            "low_memory": LOW_MEMORY,
+        }, f, indent=4)
+    os.replace(array_path + ".tmp", array_path)
+    os.replace(index_path + ".tmp", index_path)
+
+def analysis_parameters():
+    return {
+        "num_shuffles": NUM_SHUFFLES,
+        "permutation_engine": PERMUTATION_ENGINE,
+        "bonferroni_p_thresh": BONFERRONI_P_THRESH,
+        "significance_method": SIGNIFICANCE_METHOD,
+        "permutation_alpha": PERMUTATION_ALPHA,
+        "noise_seed": NOISE_SEED,
+        "sliding_window_seconds": SLIDING_WINDOW_SECONDS,
+        "sliding_step_seconds": SLIDING_STEP_SECONDS,
+        "row_level_isc": ROW_LEVEL_ISC,
+        "corrca_shrinkage": CORRCA_SHRINKAGE,
+        # the block size sets the summation order of the batched engine
+        "channel_block_size": CHANNEL_BLOCK_SIZE,
+        # float32 envelopes and chunked sums change the results in the last digits
+        "low_memory": LOW_MEMORY,
+        "accumulation_chunk": ACCUMULATION_CHUNK if LOW_MEMORY else None,
+        "array_backend": ARRAY_BACKEND,
+    }
+
+def unit_fingerprint(band_inputs):
+    payload = {
+        "parameters": analysis_parameters(),
+        "inputs": [subject_input_fingerprint(data) for data in band_inputs],
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring manifest {manifest_path}: {e}")
+        return {}
+
+@timed("save_manifest")
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def load_results(npy_path, default):
+    if RESUME and RESULT_FORMAT != "table" and os.path.exists(npy_path):
+        try:
+            return np.load(npy_path, allow_pickle=True).item()
+        except Exception as e:
+            print(f"Ignoring unreadable results {npy_path}: {e}")
+    return default
+
+@timed("save_npy")
+def save_results(npy_path, results):
+    if RESULT_FORMAT == "table":
+        return
+    # written under a temporary name first, an interrupted save keeps the previous checkpoint
+    with open(npy_path + ".tmp", "wb") as f:
+        np.save(f, results)
+    os.replace(npy_path + ".tmp", npy_path)
+
+def table_units(table_path, analysis, session, run):
+    # (pair, band) units with rows in the table, read once per session/run; the manifest alone
+    # does not prove the rows exist when the table was deleted or replaced
+    if not RESUME or RESULT_FORMAT != "table":
+        return set()
+    return stored_units(table_path, analysis, session, run)
+
+def empty_unit_entry(fingerprint):
+    # manifest entry of a unit without common electrodes, up to date although nothing was written
+    return f"empty:{fingerprint}"
+
+def unit_is_done(manifest, unit_key, fingerprint, on_disk):
+    # table rows and npy results are written before the manifest entry
+    entry = manifest.get(unit_key)
+    return RESUME and (entry == fingerprint and on_disk or entry == empty_unit_entry(fingerprint))
+
+def unit_on_disk(stored, pair, band, results=None):
+    # in table mode the unit needs its rows, otherwise the npy results have to contain the band
+    if RESULT_FORMAT == "table":
+        return (pair, band) in stored
+    return results is not None and band in results["bands"]
+
+@timed("save_table")
+def store_unit_rows(table_path, analysis, session, run, pair, subjects, band, band_results):
+    if RESULT_FORMAT not in ("table", "both"):
+        return
+    frame = correlation_rows(analysis, session, run, pair, subjects, band,
+                             band_results["correlation"], band_results["significant_chs"])
+    append_unit(table_path, frame, analysis, session, run, pair, band)
+
+@timed("corrca")
+def calculate_corrca(band_data, subjects, common_chs):
+    sfreqs = {band_data[subj]['event_data'].get('sfreq') for subj in subjects} - {None}
+    if len(sfreqs) > 1:
+        print("unmatching sampling rates")
+        return None
+
+    channels = sorted(common_chs)
+    n_samples = cohort_aligned_length(band_data, subjects, channels)
+    if n_samples < 2:
+        return None
+
+    def subject_envelopes():
+        # one subject in memory at a time
+        for subj in subjects:
+            data = subject_channel_matrix(band_data[subj]['electrode_data'], channels, n_samples)
+            yield BACKEND.to_host(extract_envelopes(data))
+
+    within, between, n_subjects = corrca_covariances(subject_envelopes())
+    isc, filters, forward = corrca_solve(within, between, n_subjects, shrinkage=CORRCA_SHRINKAGE)
+    return {
+        "channels": channels,
+        "isc": isc,
+        "filters": filters,
+        "forward": forward,
+        "n_subjects": n_subjects,
+        "n_samples": n_samples,
+    }
+
+def process_session_run_parallel(task, session, run, subjects, bids_root, isc_mode="pairwise", pool=None):
     output_dir = os.path.join(OUTPUT_BASE, task, session, run)
     os.makedirs(output_dir, exist_ok=True)
+    table_path = os.path.join(OUTPUT_BASE, task, "isc_results.h5")
     
     all_subj_data = {}
     for subj in subjects:
         subj_data = {}
+        event_data = load_run_metadata(subj, session, run, bids_root, task)
         for band in FREQUENCY_BANDS:
-            subj_data[band] = load_subject_data(subj, session, run, band, bids_root, task)
+            subj_data[band] = load_subject_data(subj, session, run, band, bids_root, task, event_data=event_data)
         all_subj_data[subj] = subj_data
     
     all_pairs = list(combinations(subjects, 2))
+    num_units = len(FREQUENCY_BANDS) * (
+        (isc_mode == "corrca") + (isc_mode in ("leave_one_out", "both")) + len(all_pairs) * (isc_mode in ("pairwise", "both"))
+    )
+    progress = Progress(num_units, trace_path(task), name=f"{session}/{run}")
+    try:
+        process_session_run_units(session, run, subjects, all_pairs, all_subj_data, output_dir, table_path,
+                                  isc_mode, pool, progress)
+    finally:
+        progress.finish()
+
+def process_session_run_units(session, run, subjects, all_pairs, all_subj_data, output_dir, table_path,
+                              isc_mode, pool, progress):
+    # metadata and store opening of every subject, done before the first unit
+    merge_stats(progress.stats, take_stats())
+    if isc_mode == "corrca":
+        process_corrca(session, run, subjects, all_subj_data, output_dir, progress)
+        return
+
+    if isc_mode in ("leave_one_out", "both"):
+        process_leave_one_out(session, run, subjects, all_subj_data, output_dir, table_path, progress)
+    if isc_mode == "leave_one_out":
+        return
+
+    pairs = pending_subject_pairs(session, run, all_pairs, all_subj_data, output_dir, table_path)
+    progress.skip((len(all_pairs) - len(pairs)) * len(FREQUENCY_BANDS))
+    if len(pairs) < len(all_pairs):
+        # subjects without any finished pair were added to the cohort since the last run
+        new_subjects = [subj for subj in subjects if all(subj not in pair or pair in pairs for pair in all_pairs)]
+        print(f"{len(all_pairs) - len(pairs)} of {len(all_pairs)} pairs up to date, new subjects: {new_subjects}")
+    if not pairs:
+        return
+
+    # only the subjects of pending pairs are copied to shared memory
+    pair_subj_data = {subj: all_subj_data[subj] for subj in sorted(set().union(*pairs))}
+    shared_blocks = []
+    if ISC_ENGINE == "pool" and pool is not None:
+        shared_blocks = share_subject_data(pair_subj_data)
+    try:
+        process_subject_pairs(session, run, pairs, pair_subj_data, output_dir, table_path, pool, progress)
+    finally:
+        release_shared_blocks(pair_subj_data, shared_blocks)
+
+def pair_results_path(output_dir, session, run, pair_key):
+    return os.path.join(output_dir, f"{session}_{run}_{pair_key}_correlation.npy")
+
+def trace_path(task):
+    return os.path.join(OUTPUT_BASE, task, TRACE_FILE) if TRACE_FILE else None
+
+def pending_subject_pairs(session, run, pairs, all_subj_data, output_dir, table_path):
+    # pairs with at least one band missing or stale, decided from the manifest and the table index
+    manifest = load_manifest(output_dir)
+    stored = table_units(table_path, "pairwise", session, run)
+    pending = []
+    for (subj1, subj2) in pairs:
+        pair_key = f"{subj1}_{subj2}"
+        pair_npy_path = pair_results_path(output_dir, session, run, pair_key)
+        npy_on_disk = os.path.exists(pair_npy_path)
+        done = all(
+            unit_is_done(manifest, f"pair/{pair_key}/{band}",
+                         unit_fingerprint([all_subj_data[subj1][band], all_subj_data[subj2][band]]),
+                         (pair_key, band) in stored if RESULT_FORMAT == "table" else npy_on_disk)
+            for band in FREQUENCY_BANDS
+        )
+        if not done:
+            pending.append((subj1, subj2))
+    return pending
+
+def calculate_pair_band(session, run, pair_key, band, subj1_data, subj2_data, output_dir, pool=None):
+    # one (session, run, pair, band) unit, None if the pair has no common electrode in the band
+    subj1_chs = set(subj1_data['electrode_data'].keys())
+    subj2_chs = set(subj2_data['electrode_data'].keys())
+    # sorted, set order changes between processes and the seeded draws follow channel order
+    common_chs = sorted(subj1_chs & subj2_chs)
+    
+    if not common_chs:
+        print(f"Warning: {pair_key} has no common electrode at {band} band")
+        return None
     
-    for (subj1, subj2) in all_pairs:
+    if ISC_ENGINE == "batched":
+        corr_data = calculate_pair_correlation_batched(
+            subj1_data,
+            subj2_data,
+            subj1_data['event_data'],
+            subj2_data['event_data'],
+            common_chs,
+            rng=noise_rng(session, run, pair_key, band)
+        )
+    else:
+        corr_data = calculate_pair_correlation_parallel(
+            subj1_data,
+            subj2_data,
+            subj1_data['event_data'],
+            subj2_data['event_data'],
+            common_chs,
+            pool=pool,
+            rng=noise_rng(session, run, pair_key, band)
+        )
+    
+    significant_chs = significant_channels(corr_data, common_chs)
+    
+    band_stats = analyze_band_proportions(significant_chs, band, len(common_chs))
+    
+    print(f"Band {band} | {pair_key}: {len(common_chs)} common elextrodes, {len(significant_chs)} correlated electrodes")
+
+    if SLIDING_WINDOW_SECONDS:
+        save_sliding_correlation(output_dir, session, run, pair_key, band, subj1_data, subj2_data, common_chs)
+    if ROW_LEVEL_ISC:
+        save_row_correlation(output_dir, session, run, pair_key, band, subj1_data, subj2_data, common_chs)
+
+    return {
+        "correlation": corr_data,
+        "significant_chs": significant_chs,
+        "common_ch_count": len(common_chs),
+        "statistics": band_stats
+    }
+
+def process_subject_pairs(session, run, pairs, all_subj_data, output_dir, table_path, pool=None, progress=None):
+    manifest = load_manifest(output_dir)
+    stored = table_units(table_path, "pairwise", session, run)
+    progress = progress or Progress(len(pairs) * len(FREQUENCY_BANDS))
+    
+    for (subj1, subj2) in pairs:
         pair_key = f"{subj1}_{subj2}"
-        pair_results = {
+        pair_npy_path = pair_results_path(output_dir, session, run, pair_key)
+        pair_results = load_results(pair_npy_path, {
             "subjects": [subj1, subj2],
             "bands": {}
-        }
+        })
         
         print(f"processing : {pair_key}")
         
         for band in FREQUENCY_BANDS:
-            print(f"processing band: {band}")
-            
             subj1_data = all_subj_data[subj1][band]
             subj2_data = all_subj_data[subj2][band]
-            
-            subj1_chs = set(subj1_data['electrode_data'].keys())
-            subj2_chs = set(subj2_data['electrode_data'].keys())
-            common_chs = list(subj1_chs & subj2_chs)
-            
-            if not common_chs:
-                print(f"Warning: {pair_key} has no common electrode at {band} band")
+
+            unit_key = f"pair/{pair_key}/{band}"
+            fingerprint = unit_fingerprint([subj1_data, subj2_data])
+            if unit_is_done(manifest, unit_key, fingerprint, unit_on_disk(stored, pair_key, band, pair_results)):
+                print(f"skipping band {band}: up to date")
+                progress.skip()
                 continue
-            
-            corr_data = calculate_pair_correlation_parallel(
-                subj1_data, 
-                subj2_data,
-                subj1_data['event_data'],
-                subj2_data['event_data'],
-                common_chs
-            )
-            
-            significant_chs = [
-                ch for ch in common_chs 
-                if corr_data[ch]["original"]["p"] < BONFERRONI_P_THRESH
-            ]
-            
-            band_stats = analyze_band_proportions(significant_chs, band, len(common_chs))
-            
-            pair_results["bands"][band] = {
-                "correlation": corr_data,
-                "significant_chs": significant_chs,
-                "common_ch_count": len(common_chs),
-                "statistics": band_stats
-            }
-            
-            print(f"Band {band}: {len(common_chs)} common elextrodes, {len(significant_chs)} correlated electrodes")
+
+            print(f"processing band: {band}")
+            band_results = calculate_pair_band(session, run, pair_key, band, subj1_data, subj2_data, output_dir, pool)
+            if band_results is None:
+                manifest[unit_key] = empty_unit_entry(fingerprint)
+                save_manifest(output_dir, manifest)
+                progress.skip()
+                continue
+            pair_results["bands"][band] = band_results
+
+            # checkpoint after every band, the manifest only lists units that are on disk
+            store_unit_rows(table_path, "pairwise", session, run, pair_key, [subj1, subj2], band, band_results)
+            save_results(pair_npy_path, pair_results)
+            manifest[unit_key] = fingerprint
+            save_manifest(output_dir, manifest)
+            progress.update(f"{session} | {run} | {pair_key} | {band}", take_stats())
         
-        pair_npy_path = os.path.join(output_dir, f"{session}_{run}_{pair_key}_correlation.npy")
-        np.save(pair_npy_path, pair_results)
+        save_results(pair_npy_path, pair_results)
         
         print(f"Storage Finish: Session {session} | Run {run} | subject {pair_key}")
 
-def main(bids_params):
-    os.makedirs(OUTPUT_BASE, exist_ok=True)
+def loo_results_path(output_dir, session, run, subj):
+    return os.path.join(output_dir, f"{session}_{run}_{subj}_loo_correlation.npy")
+
+def empty_loo_results(subj):
+    return {"subjects": [subj], "reference": "leave_one_out_mean", "bands": {}}
+
+def calculate_leave_one_out_band(session, run, band, band_data, subjects, output_dir):
+    # one (session, run, band) leave-one-out unit, {subject: band results} or None without common electrodes
+    common_chs = set.intersection(*(set(band_data[subj]['electrode_data'].keys()) for subj in subjects))
+
+    if not common_chs:
+        print(f"Warning: no common electrode across subjects at {band} band")
+        return None
+
+    channels = sorted(common_chs)
+    sum_paths = cohort_sum_paths(output_dir, session, run, band)
+    cohort_sum = load_cohort_sum(sum_paths, band_data, subjects, channels)
+    if cohort_sum is not None:
+        added = [subj for subj in subjects if subj not in cohort_sum["subjects"]]
+        print(f"reusing cohort envelope sum of {len(cohort_sum['subjects'])} subjects, adding {added}")
+
+    sum_out = open_cohort_sum(sum_paths, channels, cohort_aligned_length(band_data, subjects, channels))
+    loo_results = calculate_leave_one_out_correlation(
+        band_data, subjects, common_chs,
+        rng=noise_rng(session, run, "leave_one_out", band),
+        cohort_sum=cohort_sum,
+        sum_out=sum_out
+    )
+    save_cohort_sum(sum_paths, band_data, subjects, channels, sum_out if loo_results else None)
+
+    band_results = {}
+    for subj, corr_data in loo_results.items():
+        significant_chs = significant_channels(corr_data, list(corr_data))
+        band_results[subj] = {
+            "correlation": corr_data,
+            "significant_chs": significant_chs,
+            "common_ch_count": len(common_chs),
+            "statistics": analyze_band_proportions(significant_chs, band, len(common_chs))
+        }
+        print(f"Band {band} | {subj}: {len(common_chs)} common elextrodes, {len(significant_chs)} correlated electrodes")
+    return band_results
+
+def process_leave_one_out(session, run, subjects, all_subj_data, output_dir, table_path, progress=None):
+    progress = progress or Progress(len(FREQUENCY_BANDS))
+    if len(subjects) < 2:
+        print("leave-one-out ISC needs at least two subjects")
+        progress.skip(len(FREQUENCY_BANDS))
+        return
+
+    manifest = load_manifest(output_dir)
+    stored = table_units(table_path, "leave_one_out", session, run)
+    loo_npy_paths = {subj: loo_results_path(output_dir, session, run, subj) for subj in subjects}
+    subject_results = {subj: load_results(loo_npy_paths[subj], empty_loo_results(subj)) for subj in subjects}
+
+    for band in FREQUENCY_BANDS:
+        band_data = {subj: all_subj_data[subj][band] for subj in subjects}
+
+        # every subject's reference depends on the whole cohort
+        fingerprint = unit_fingerprint([band_data[subj] for subj in subjects])
+        if all(unit_is_done(manifest, f"loo/{subj}/{band}", fingerprint, unit_on_disk(stored, subj, band, subject_results[subj]))
+               for subj in subjects):
+            print(f"skipping leave-one-out band {band}: up to date")
+            progress.skip()
+            continue
+
+        print(f"processing leave-one-out band: {band}")
+        band_results = calculate_leave_one_out_band(session, run, band, band_data, subjects, output_dir)
+        if band_results is None:
+            for subj in subjects:
+                manifest[f"loo/{subj}/{band}"] = empty_unit_entry(fingerprint)
+            save_manifest(output_dir, manifest)
+            progress.skip()
+            continue
+
+        for subj, subj_band_results in band_results.items():
+            subject_results[subj]["bands"][band] = subj_band_results
+            store_unit_rows(table_path, "leave_one_out", session, run, subj, [subj, ""], band, subj_band_results)
+            save_results(loo_npy_paths[subj], subject_results[subj])
+            manifest[f"loo/{subj}/{band}"] = fingerprint
+        save_manifest(output_dir, manifest)
+        progress.update(f"{session} | {run} | leave_one_out | {band}", take_stats())
+
+    for subj, results in subject_results.items():
+        save_results(loo_npy_paths[subj], results)
+        print(f"Storage Finish: Session {session} | Run {run} | subject {subj} (leave-one-out)")
+
+def corrca_results_path(output_dir, session, run, band):
+    return os.path.join(output_dir, f"{session}_{run}_{band}_corrca.npz")
+
+def calculate_corrca_band(session, run, band, band_data, subjects, output_dir):
+    # one (session, run, band) CorrCA unit, written to its npz file; False if nothing was written
+    common_chs = set.intersection(*(set(band_data[subj]['electrode_data'].keys()) for subj in subjects))
+    if not common_chs:
+        print(f"Warning: no common electrode across subjects at {band} band")
+        return False
+
+    corrca_results = calculate_corrca(band_data, subjects, common_chs)
+    if corrca_results is None:
+        return False
 
+    np.savez(corrca_results_path(output_dir, session, run, band), isc=corrca_results["isc"], filters=corrca_results["filters"],
+             forward=corrca_results["forward"], channels=np.array(corrca_results["channels"]),
+             subjects=np.array(subjects), n_samples=corrca_results["n_samples"])
+
+    top_isc = ", ".join(f"{value:.4f}" for value in corrca_results["isc"][:3])
+    print(f"Band {band}: CorrCA over {len(subjects)} subjects, strongest component ISC {top_isc}")
+    return True
+
+def process_corrca(session, run, subjects, all_subj_data, output_dir, progress=None):
+    progress = progress or Progress(len(FREQUENCY_BANDS))
+    if len(subjects) < 2:
+        print("CorrCA needs at least two subjects")
+        progress.skip(len(FREQUENCY_BANDS))
+        return
+
+    manifest = load_manifest(output_dir)
+    for band in FREQUENCY_BANDS:
+        band_data = {subj: all_subj_data[subj][band] for subj in subjects}
+
+        unit_key = f"corrca/{band}"
+        fingerprint = unit_fingerprint([band_data[subj] for subj in subjects])
+        if unit_is_done(manifest, unit_key, fingerprint, os.path.exists(corrca_results_path(output_dir, session, run, band))):
+            print(f"skipping CorrCA band {band}: up to date")
+            progress.skip()
+            continue
+
+        print(f"processing CorrCA band: {band}")
+        if calculate_corrca_band(session, run, band, band_data, subjects, output_dir):
+            manifest[unit_key] = fingerprint
+            save_manifest(output_dir, manifest)
+            progress.update(f"{session} | {run} | corrca | {band}", take_stats())
+        else:
+            manifest[unit_key] = empty_unit_entry(fingerprint)
+            save_manifest(output_dir, manifest)
+            progress.skip()
+
+def unit_memory_bytes(kind, n_channels, n_samples):
+    # rough float64 peak of one unit, used to size the scheduler
+    block = min(channel_block_size(n_samples), n_channels)
+    if kind in ("pair", "loo"):
+        # data, envelopes and FFT buffers of one channel block, the rest stays memory-mapped
+        rows = 8 * block
+    else:
+        # one subject matrix, its centered copy and the cohort sum
+        rows = 3 * n_channels
+    return 8 * n_samples * rows
+
+def plan_session_run_units(task, session, run, subjects, bids_root, isc_mode):
+    # Pending units of one session/run. The packed stores are only opened for their fingerprint
+    # and size here, each worker opens the data of its own unit and drops it when the unit is done.
+    output_dir = os.path.join(OUTPUT_BASE, task, session, run)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    table_path = os.path.join(OUTPUT_BASE, task, "isc_results.h5")
+    stored_pairs = table_units(table_path, "pairwise", session, run)
+    stored_loo = table_units(table_path, "leave_one_out", session, run)
+
+    refs = {}
+    for subj in subjects:
+        event_data = load_run_metadata(subj, session, run, bids_root, task)
+        for band in FREQUENCY_BANDS:
+            data = load_subject_data(subj, session, run, band, bids_root, task, event_data=event_data)
+            lengths = [len(row) for row in data['electrode_data'].values()]
+            refs[subj, band] = {
+                'input_fingerprint': data['input_fingerprint'],
+                'event_data': event_data,
+                'n_channels': len(lengths),
+                'n_samples': max(lengths, default=0),
+            }
+
+    def unit(kind, band, unit_subjects, unit_keys, on_disk):
+        band_refs = [refs[subj, band] for subj in unit_subjects]
+        fingerprint = unit_fingerprint(band_refs)
+        if all(unit_is_done(manifest, key, fingerprint, on_disk) for key in unit_keys):
+            return None
+        return {
+            "kind": kind, "task": task, "session": session, "run": run, "band": band,
+            "bids_root": bids_root, "subjects": list(unit_subjects), "output_dir": output_dir,
+            "unit_keys": unit_keys, "fingerprint": fingerprint,
+            "memory": unit_memory_bytes(kind, max(ref['n_channels'] for ref in band_refs),
+                                        max(ref['n_samples'] for ref in band_refs)),
+        }
+
+    units = []
+    table = RESULT_FORMAT == "table"
+    for band in FREQUENCY_BANDS:
+        if isc_mode == "corrca" and len(subjects) > 1:
+            units.append(unit("corrca", band, subjects, [f"corrca/{band}"],
+                              os.path.exists(corrca_results_path(output_dir, session, run, band))))
+        if isc_mode in ("leave_one_out", "both") and len(subjects) > 1:
+            units.append(unit("loo", band, subjects, [f"loo/{subj}/{band}" for subj in subjects],
+                              all((subj, band) in stored_loo for subj in subjects) if table
+                              else all(os.path.exists(loo_results_path(output_dir, session, run, subj)) for subj in subjects)))
+        if isc_mode in ("pairwise", "both"):
+            for (subj1, subj2) in combinations(subjects, 2):
+                pair_key = f"{subj1}_{subj2}"
+                units.append(unit("pair", band, [subj1, subj2], [f"pair/{pair_key}/{band}"],
+                                  (pair_key, band) in stored_pairs if table
+                                  else os.path.exists(pair_results_path(output_dir, session, run, pair_key))))
+    return [item for item in units if item is not None]
+
+def module_settings():
+    # plain settings of this module, spawned workers would otherwise re-import the file defaults
+    return {
+        name: value for name, value in globals().items()
+        if name.isupper() and not name.startswith("_")
+        and isinstance(value, (str, int, float, bool, list, tuple, dict, type(None)))
+    }
+
+def apply_module_settings(settings):
+    global BACKEND, GPU_AVAILABLE
+    rebuild_backend = settings.get("ARRAY_BACKEND", ARRAY_BACKEND) != ARRAY_BACKEND
+    globals().update(settings)
+    if rebuild_backend:
+        BACKEND = get_backend(ARRAY_BACKEND)
+        GPU_AVAILABLE = BACKEND.name == "cupy"
+
+def run_isc_unit(unit):
+    # scheduler worker: open the unit's subject data, compute it, return the results for the parent to store
+    band = unit["band"]
+    band_data = {
+        subj: load_subject_data(subj, unit["session"], unit["run"], band, unit["bids_root"], unit["task"])
+        for subj in unit["subjects"]
+    }
+    if unit["kind"] == "pair":
+        subj1, subj2 = unit["subjects"]
+        results = calculate_pair_band(unit["session"], unit["run"], f"{subj1}_{subj2}", band,
+                                      band_data[subj1], band_data[subj2], unit["output_dir"])
+    elif unit["kind"] == "loo":
+        results = calculate_leave_one_out_band(unit["session"], unit["run"], band, band_data,
+                                               unit["subjects"], unit["output_dir"])
+    else:
+        results = calculate_corrca_band(unit["session"], unit["run"], band, band_data,
+                                        unit["subjects"], unit["output_dir"])
+    return unit, results, take_stats()
+
+def store_scheduled_unit(unit, results):
+    # only the parent writes the pair/leave-one-out .npy results, the table and the manifests
+    session, run, band, output_dir = unit["session"], unit["run"], unit["band"], unit["output_dir"]
+    table_path = os.path.join(OUTPUT_BASE, unit["task"], "isc_results.h5")
+
+    entry = unit["fingerprint"]
+    if not results:
+        # recorded as well, a unit without common electrodes would otherwise be rescheduled on every resume
+        entry = empty_unit_entry(unit["fingerprint"])
+    elif unit["kind"] == "pair":
+        subj1, subj2 = unit["subjects"]
+        pair_key = f"{subj1}_{subj2}"
+        pair_npy_path = pair_results_path(output_dir, session, run, pair_key)
+        pair_results = load_results(pair_npy_path, {"subjects": [subj1, subj2], "bands": {}})
+        pair_results["bands"][band] = results
+        store_unit_rows(table_path, "pairwise", session, run, pair_key, [subj1, subj2], band, results)
+        save_results(pair_npy_path, pair_results)
+    elif unit["kind"] == "loo":
+        for subj, subj_band_results in results.items():
+            subj_npy_path = loo_results_path(output_dir, session, run, subj)
+            subject_results = load_results(subj_npy_path, empty_loo_results(subj))
+            subject_results["bands"][band] = subj_band_results
+            store_unit_rows(table_path, "leave_one_out", session, run, subj, [subj, ""], band, subj_band_results)
+            save_results(subj_npy_path, subject_results)
+
+    manifest = load_manifest(output_dir)
+    for key in unit["unit_keys"]:
+        manifest[key] = entry
+    save_manifest(output_dir, manifest)
+
+def run_unit_schedule(bids_params):
+    isc_mode = bids_params.get("isc_mode", "pairwise")
+    take_stats()
+    units = []
+    for session, run in session_runs(bids_params):
+        run_units = plan_session_run_units(bids_params["task"], session, run, bids_params["subjects"],
+                                           bids_params["bids_root"], isc_mode)
+        print(f"Session {session} | Run {run}: {len(run_units)} units to compute")
+        units.extend(run_units)
+    if not units:
+        print("all units up to date")
+        return
+
+    # largest units first so the tail of the sweep is made of short units
+    units.sort(key=lambda unit: unit["memory"], reverse=True)
+    num_workers = worker_count(len(units), units[0]["memory"], SCHEDULER_WORKERS, SCHEDULER_MEMORY_FRACTION)
+    print(f"Scheduling {len(units)} units on {num_workers} workers")
+
+    progress = Progress(len(units), trace_path(bids_params["task"]), name="units")
+    # planning reads metadata and opens the stores of every subject
+    merge_stats(progress.stats, take_stats())
+
+    if num_workers == 1:
+        completed = map(run_isc_unit, units)
+        pool = None
+    else:
+        pool = Pool(processes=num_workers, initializer=apply_module_settings, initargs=(module_settings(),))
+        completed = pool.imap_unordered(run_isc_unit, units)
+    try:
+        for unit, results, stats in completed:
+            store_scheduled_unit(unit, results)
+            label = "_".join(unit["subjects"]) if unit["kind"] == "pair" else unit["kind"]
+            # worker stages plus the parent's storing
+            progress.update(f"{unit['session']} | {unit['run']} | {label} | {unit['band']}",
+                            merge_stats(stats, take_stats()), kind=unit["kind"])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        progress.finish()
+
+def session_runs(bids_params):
     for session in bids_params["sessions"]:
         current_runs = bids_params["runs"] if session == "littleprince" else bids_params.get("runs2", [])
         for run in current_runs:
-            subjects = bids_params["subjects"]
-            task = bids_params["task"]
-            process_session_run_parallel(task, session, run, subjects, bids_params["bids_root"])
+            yield session, run
+
+def main(bids_params):
+    if PERMUTATION_ENGINE not in ("fft", "shift"):
+        raise ValueError(f"unknown PERMUTATION_ENGINE {PERMUTATION_ENGINE!r}, expected 'fft' or 'shift'")
+    os.makedirs(OUTPUT_BASE, exist_ok=True)
+
+    if SCHEDULER == "units" and ISC_ENGINE == "batched":
+        run_unit_schedule(bids_params)
+        return
+
+    # one pool for the whole sweep, workers import MNE/CuPy only once and get this module's settings
+    pool = None
+    if ISC_ENGINE == "pool":
+        pool = Pool(processes=NUM_PROCESSES, initializer=apply_module_settings, initargs=(module_settings(),))
+    try:
+        for session, run in session_runs(bids_params):
+            process_session_run_parallel(bids_params["task"], session, run, bids_params["subjects"],
+                                         bids_params["bids_root"], isc_mode=bids_params.get("isc_mode", "pairwise"),
+                                         pool=pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 if __name__ == "__main__":
     mp.set_start_method('spawn', force=True)
@@ -601,6 +1802,7 @@ if __name__ == "__main__":
         "runs": ["runs1", "runs2"], 
         "runs2":["runs1", "runs2"],
         "subjects": ["subj1", "subj2"],            
-        "task": "reading"                                       
+        "task": "reading",
+        "isc_mode": "pairwise"   # "pairwise", "leave_one_out", "both" or "corrca"
     }
     main(analysis_params)
@@ -0,0 +1,213 @@
+'''
+Array backends for isc_analysis.py.
+
+The ISC engine only needs three batched kernels: Hilbert envelopes, circular
+shift correlations and row-wise Pearson sums. Each backend implements them on
+(channels, samples) arrays (1-D arrays work as a single row), so the analysis
+runs the same code path on every backend:
+
+    numpy  - default, always available
+    cupy   - GPU arrays, used by "auto" when CuPy and a device are available
+    numba  - threaded CPU kernels (Numba row reductions, multi-worker scipy.fft)
+'''
+import os
+import numpy as np
+
+
+class NumpyBackend:
+    name = "numpy"
+
+    def __init__(self):
+        self.xp = np
+
+    def asarray(self, data):
+        return self.xp.asarray(data, dtype=self.xp.float64)
+
+    def to_host(self, data):
+        return np.asarray(data)
+
+    def _rfft(self, data, n):
+        return self.xp.fft.rfft(data, n=n, axis=-1)
+
+    def _irfft(self, spectrum, n):
+        return self.xp.fft.irfft(spectrum, n=n, axis=-1)
+
+    def _fft(self, data):
+        return self.xp.fft.fft(data, axis=-1)
+
+    def _ifft(self, spectrum):
+        return self.xp.fft.ifft(spectrum, axis=-1)
+
+    def envelopes(self, data):
+        '''
+        Magnitude of the analytic signal along the last axis (same as scipy.signal.hilbert).
+        '''
+        xp = self.xp
+        data = self.asarray(data)
+        n = data.shape[-1]
+        if n < 2:
+            return xp.abs(data)
+        h = xp.zeros(n)
+        if n % 2 == 0:
+            h[0] = h[n // 2] = 1
+            h[1:n // 2] = 2
+        else:
+            h[0] = 1
+            h[1:(n + 1) // 2] = 2
+        return xp.abs(self._ifft(self._fft(data) * h))
+
+    def circular_shift_correlation(self, envelope1, envelope2, shift_points=None):
+        '''
+        Pearson r of envelope1 against every circular shift of envelope2 along the
+        last axis, shift k == roll(envelope2, -k), from one FFT cross-correlation.
+
+        :param shift_points: optional shift indices, gathered before copying to host
+        :return: host array of r values, shape (..., n_samples) or shift_points.shape
+        '''
+        xp = self.xp
+        x = self.asarray(envelope1)
+        y = self.asarray(envelope2)
+        x = x - xp.mean(x, axis=-1, keepdims=True)
+        y = y - xp.mean(y, axis=-1, keepdims=True)
+        denominator = xp.sqrt(xp.sum(x**2, axis=-1, keepdims=True) * xp.sum(y**2, axis=-1, keepdims=True))
+        n = x.shape[-1]
+        xcorr = self._irfft(xp.conj(self._rfft(x, n)) * self._rfft(y, n), n)
+        safe_denominator = xp.where(denominator > 0, denominator, 1)
+        r_values = xp.where(denominator > 0, xcorr / safe_denominator, 0)
+        if shift_points is not None:
+            r_values = xp.take_along_axis(r_values, xp.asarray(shift_points), axis=-1)
+        return self.to_host(r_values)
+
+    def pearson_sums(self, x, y):
+        '''
+        Row-wise Pearson numerator and denominator of two (rows, samples) arrays.
+
+        :return: host arrays (numerator, denominator), one value per row
+        '''
+        xp = self.xp
+        x = self.asarray(x)
+        y = self.asarray(y)
+        x = x - xp.mean(x, axis=1, keepdims=True)
+        y = y - xp.mean(y, axis=1, keepdims=True)
+        numerator = xp.einsum('ij,ij->i', x, y)
+        denominator = xp.sqrt(xp.einsum('ij,ij->i', x, x) * xp.einsum('ij,ij->i', y, y))
+        return self.to_host(numerator), self.to_host(denominator)
+
+    def pearson_sums_chunked(self, x, y, chunk):
+        '''
+        pearson_sums accumulated in float64 over column chunks of at most chunk samples,
+        so float32 inputs are never converted or centered as a whole.
+        '''
+        xp = self.xp
+        n_rows, n_samples = x.shape
+        sum_x = xp.zeros(n_rows)
+        sum_y = xp.zeros(n_rows)
+        for start in range(0, n_samples, chunk):
+            sum_x += xp.sum(self.asarray(x[:, start:start + chunk]), axis=1)
+            sum_y += xp.sum(self.asarray(y[:, start:start + chunk]), axis=1)
+        mean_x = sum_x[:, None] / n_samples
+        mean_y = sum_y[:, None] / n_samples
+
+        numerator = xp.zeros(n_rows)
+        sum_xx = xp.zeros(n_rows)
+        sum_yy = xp.zeros(n_rows)
+        for start in range(0, n_samples, chunk):
+            x_chunk = self.asarray(x[:, start:start + chunk]) - mean_x
+            y_chunk = self.asarray(y[:, start:start + chunk]) - mean_y
+            numerator += xp.einsum('ij,ij->i', x_chunk, y_chunk)
+            sum_xx += xp.einsum('ij,ij->i', x_chunk, x_chunk)
+            sum_yy += xp.einsum('ij,ij->i', y_chunk, y_chunk)
+        return self.to_host(numerator), self.to_host(xp.sqrt(sum_xx * sum_yy))
+
+
+class CupyBackend(NumpyBackend):
+    name = "cupy"
+
+    def __init__(self):
+        import cupy as cp
+        cp.cuda.runtime.getDeviceCount()
+        self.xp = cp
+
+    def to_host(self, data):
+        return self.xp.asnumpy(data)
+
+
+class NumbaBackend(NumpyBackend):
+    name = "numba"
+
+    def __init__(self):
+        import numba
+        import scipy.fft
+
+        self.xp = np
+        self._scipy_fft = scipy.fft
+        self._workers = os.cpu_count() or 1
+
+        @numba.njit(parallel=True, cache=True)
+        def pearson_sums_kernel(x, y):
+            n_rows, n_samples = x.shape
+            numerator = np.empty(n_rows)
+            denominator = np.empty(n_rows)
+            for i in numba.prange(n_rows):
+                mean_x = x[i].mean()
+                mean_y = y[i].mean()
+                sum_xy = 0.0
+                sum_xx = 0.0
+                sum_yy = 0.0
+                for j in range(n_samples):
+                    dx = x[i, j] - mean_x
+                    dy = y[i, j] - mean_y
+                    sum_xy += dx * dy
+                    sum_xx += dx * dx
+                    sum_yy += dy * dy
+                numerator[i] = sum_xy
+                denominator[i] = np.sqrt(sum_xx * sum_yy)
+            return numerator, denominator
+
+        self._pearson_sums_kernel = pearson_sums_kernel
+
+    def _rfft(self, data, n):
+        return self._scipy_fft.rfft(data, n=n, axis=-1, workers=self._workers)
+
+    def _irfft(self, spectrum, n):
+        return self._scipy_fft.irfft(spectrum, n=n, axis=-1, workers=self._workers)
+
+    def _fft(self, data):
+        return self._scipy_fft.fft(data, axis=-1, workers=self._workers)
+
+    def _ifft(self, spectrum):
+        return self._scipy_fft.ifft(spectrum, axis=-1, workers=self._workers)
+
+    def pearson_sums(self, x, y):
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        y = np.ascontiguousarray(y, dtype=np.float64)
+        return self._pearson_sums_kernel(x, y)
+
+
+BACKENDS = {
+    "numpy": NumpyBackend,
+    "cupy": CupyBackend,
+    "numba": NumbaBackend,
+}
+
+
+def get_backend(name="auto"):
+    '''
+    Create the array backend.
+
+    :param name: "numpy", "cupy", "numba" or "auto" (CuPy if usable, NumPy otherwise)
+    :return: backend instance; a requested backend that cannot be loaded falls back to NumPy
+    '''
+    if name == "auto":
+        try:
+            return CupyBackend()
+        except Exception:
+            return NumpyBackend()
+
+    if name not in BACKENDS:
+        raise ValueError(f"unknown array backend {name!r}, expected one of {sorted(BACKENDS)} or 'auto'")
+    try:
+        return BACKENDS[name]()
+    except Exception as e:
+        print(f"{name} backend not available ({e}), using numpy")
+        return NumpyBackend()
@@ -0,0 +1,159 @@
+'''
+Stage timings, counters and progress reporting for isc_analysis.py.
+
+Every process keeps its own totals. Code sections are timed with
+
+    with stage("permutation"):
+        ...
+
+or with the @timed("load") decorator, and count("channels", n) adds to a
+counter. Stages are inclusive, a stage that calls another timed function also
+contains its time. Pool workers send take_stats() back with their results and
+the parent adds them with add_stats(), so the totals of a unit cover every
+worker that took part in it.
+
+Progress prints each finished unit with an ETA from the observed completion
+rate and appends one JSON line per unit (and a final summary) to a trace file.
+'''
+import os
+import json
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+_STAGES = {}
+_COUNTERS = {}
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        calls, seconds = _STAGES.get(name, (0, 0.0))
+        _STAGES[name] = (calls + 1, seconds + time.perf_counter() - start)
+
+
+def timed(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    _COUNTERS[name] = _COUNTERS.get(name, 0) + n
+
+
+def take_stats():
+    '''
+    Stage totals and counters recorded in this process since the last call, the totals are reset.
+
+    :return: {"stages": {name: {"calls": int, "seconds": float}}, "counters": {name: number}}
+    '''
+    stats = {
+        "stages": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in _STAGES.items()},
+        "counters": dict(_COUNTERS),
+    }
+    _STAGES.clear()
+    _COUNTERS.clear()
+    return stats
+
+
+def merge_stats(total, stats):
+    # adds stats into total in place
+    for name, values in stats.get("stages", {}).items():
+        entry = total["stages"].setdefault(name, {"calls": 0, "seconds": 0.0})
+        entry["calls"] += values["calls"]
+        entry["seconds"] += values["seconds"]
+    for name, value in stats.get("counters", {}).items():
+        total["counters"][name] = total["counters"].get(name, 0) + value
+    return total
+
+
+def add_stats(stats):
+    # stats of a pool worker, added to the totals of this process
+    if not stats:
+        return
+    for name, values in stats.get("stages", {}).items():
+        calls, seconds = _STAGES.get(name, (0, 0.0))
+        _STAGES[name] = (calls + values["calls"], seconds + values["seconds"])
+    for name, value in stats.get("counters", {}).items():
+        count(name, value)
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class Progress:
+    '''
+    Finished-unit counter with an ETA and an optional JSON-lines trace.
+
+    :param total: number of units expected
+    :param trace_path: trace file to append to, None to only print
+    :param name: name of the sweep in the trace
+    '''
+    def __init__(self, total, trace_path=None, name="isc"):
+        self.total = total
+        self.completed = 0
+        self.name = name
+        self.trace_path = trace_path
+        self.start = time.perf_counter()
+        self.stats = {"stages": {}, "counters": {}}
+        self._write({"event": "start", "total": total})
+
+    def _write(self, record):
+        if not self.trace_path:
+            return
+        os.makedirs(os.path.dirname(self.trace_path) or ".", exist_ok=True)
+        record = {"time": time.time(), "sweep": self.name, **record}
+        with open(self.trace_path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    def skip(self, n=1):
+        # units found up to date, they do not count towards the completion rate
+        self.total -= n
+
+    def eta(self):
+        if not self.completed:
+            return None
+        elapsed = time.perf_counter() - self.start
+        return elapsed / self.completed * max(self.total - self.completed, 0)
+
+    def update(self, unit, stats=None, **fields):
+        self.completed += 1
+        if stats:
+            merge_stats(self.stats, stats)
+        elapsed = time.perf_counter() - self.start
+        eta = self.eta()
+        print(f"[{self.completed}/{self.total}] {unit} | elapsed {format_seconds(elapsed)} | ETA {format_seconds(eta)}")
+        self._write({
+            "event": "unit",
+            "unit": unit,
+            "completed": self.completed,
+            "total": self.total,
+            "elapsed_seconds": elapsed,
+            "eta_seconds": eta,
+            "stats": stats,
+            **fields,
+        })
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        stages = sorted(self.stats["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+        if stages:
+            print(f"{self.name}: {self.completed} units in {format_seconds(elapsed)}")
+            for name, values in stages:
+                print(f"  {name:<14} {values['seconds']:10.2f} s in {values['calls']} calls")
+        self._write({"event": "summary", "completed": self.completed, "elapsed_seconds": elapsed,
+                     "stats": self.stats})
@@ -0,0 +1,142 @@
+'''
+Columnar ISC result table used by isc_analysis.py.
+
+Results are appended to an HDF5 table (pandas HDFStore, format='table') with one
+row per (analysis, session, run, pair, band, channel) and typed columns for the
+original, time-shift null and noise statistics. All columns are data columns,
+so group-level queries do not need to load or unpickle anything else, e.g.
+
+    read_results("output_path/reading/isc_results.h5",
+                 where="band == 'Alpha' & significant == True")
+'''
+import os
+import numpy as np
+import pandas as pd
+
+RESULT_KEY = "isc"
+# longest subject id, a pair key is two subject ids joined by "_"
+SUBJECT_SIZE = 32
+# reserved string widths, HDF5 tables cannot grow a string column after the first append
+STRING_SIZES = {
+    "analysis": 16,
+    "session": 32,
+    "run": 32,
+    "pair": 2 * SUBJECT_SIZE + 1,
+    "subject1": SUBJECT_SIZE,
+    "subject2": SUBJECT_SIZE,
+    "band": 16,
+    "channel": 16,
+}
+FLOAT_COLUMNS = [
+    "r", "p",
+    "null_r_mean", "null_r_std", "null_r_min", "null_r_max", "null_p_mean",
+    "p_permutation", "p_fwer", "p_fdr",
+    "noise_r", "noise_p",
+]
+RESULT_COLUMNS = list(STRING_SIZES) + FLOAT_COLUMNS + ["num_shuffles", "significant"]
+
+
+def correlation_rows(analysis, session, run, pair, subjects, band, corr_data, significant_chs):
+    '''
+    Flatten the per-channel results of one unit into table rows.
+
+    :param analysis: "pairwise" or "leave_one_out"
+    :param pair: pair key (e.g. "subj1_subj2") or the subject for leave-one-out
+    :param subjects: [subject1, subject2]; subject2 is "" for leave-one-out
+    :param corr_data: {channel: {"original": ..., "random": ..., "noise": ...}}
+    :param significant_chs: channels passing the significance threshold
+    :return: DataFrame with one row per channel
+    :raises ValueError: if a key is longer than its reserved width in STRING_SIZES
+    '''
+    significant = set(significant_chs)
+    rows = []
+    for ch, result in corr_data.items():
+        null_stats = result["random"].get("statistics", {})
+        rows.append({
+            "analysis": analysis,
+            "session": session,
+            "run": run,
+            "pair": pair,
+            "subject1": subjects[0],
+            "subject2": subjects[1],
+            "band": band,
+            "channel": ch,
+            "r": result["original"]["r"],
+            "p": result["original"]["p"],
+            "null_r_mean": null_stats.get("r_mean", np.nan),
+            "null_r_std": null_stats.get("r_std", np.nan),
+            "null_r_min": null_stats.get("r_min", np.nan),
+            "null_r_max": null_stats.get("r_max", np.nan),
+            "null_p_mean": null_stats.get("p_mean", np.nan),
+            "p_permutation": result["random"].get("p_permutation", np.nan),
+            "p_fwer": result["random"].get("p_fwer", np.nan),
+            "p_fdr": result["random"].get("p_fdr", np.nan),
+            "num_shuffles": null_stats.get("num_shuffles", 0),
+            "noise_r": result["noise"]["r"],
+            "noise_p": result["noise"]["p"],
+            "significant": ch in significant,
+        })
+
+    frame = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    check_string_sizes(frame, STRING_SIZES)
+    frame[FLOAT_COLUMNS] = frame[FLOAT_COLUMNS].astype(np.float64)
+    frame["num_shuffles"] = frame["num_shuffles"].astype(np.int32)
+    frame["significant"] = frame["significant"].astype(bool)
+    return frame
+
+
+def check_string_sizes(frame, sizes):
+    # PyTables rejects longer values, checked up front instead of after the unit's old rows were removed
+    for column, size in sizes.items():
+        too_long = [value for value in frame[column].unique() if len(value.encode("utf-8")) > size]
+        if too_long:
+            raise ValueError(f"{column} {too_long[0]!r} is longer than the {size} bytes reserved in the result table")
+
+
+def unit_where(analysis, session, run, pair, band):
+    return (f"analysis == {analysis!r} & session == {session!r} & run == {run!r} "
+            f"& pair == {pair!r} & band == {band!r}")
+
+
+def append_unit(table_path, frame, analysis, session, run, pair, band):
+    '''
+    Append the rows of one unit, replacing rows a previous run wrote for the same unit.
+    '''
+    os.makedirs(os.path.dirname(table_path) or ".", exist_ok=True)
+    with pd.HDFStore(table_path, mode="a") as store:
+        exists = RESULT_KEY in store
+        if exists:
+            # tables written with narrower widths keep them
+            coldtypes = store.get_storer(RESULT_KEY).table.coldtypes
+            check_string_sizes(frame, {column: coldtypes[column].itemsize for column in STRING_SIZES})
+            store.remove(RESULT_KEY, where=unit_where(analysis, session, run, pair, band))
+        if len(frame):
+            store.append(RESULT_KEY, frame.reset_index(drop=True), format="table", data_columns=True,
+                         min_itemsize=None if exists else STRING_SIZES, index=False)
+
+
+def stored_units(table_path, analysis, session, run):
+    '''
+    Units of one session/run that have rows in the table.
+
+    :return: set of (pair, band), empty when the table does not exist
+    '''
+    if not os.path.exists(table_path):
+        return set()
+    with pd.HDFStore(table_path, mode="r") as store:
+        if RESULT_KEY not in store:
+            return set()
+        frame = store.select(RESULT_KEY, columns=["pair", "band"],
+                             where=f"analysis == {analysis!r} & session == {session!r} & run == {run!r}")
+    return set(zip(frame["pair"], frame["band"]))
+
+
+def read_results(table_path, where=None, columns=None):
+    '''
+    Read rows of the result table.
+
+    :param where: optional PyTables query on any column, e.g. "band == 'Delta'"
+    :param columns: optional list of columns to load
+    :return: DataFrame
+    '''
+    return pd.read_hdf(table_path, RESULT_KEY, where=where, columns=columns)
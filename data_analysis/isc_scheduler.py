@@ -0,0 +1,52 @@
+'''
+Worker sizing for the unit scheduler of isc_analysis.py.
+
+The scheduler runs independent (session, run, pair, band) units on one process
+pool. The number of workers is the smallest of the usable cores, the number of
+units and the number of largest units that fit in the available memory. available_memory_bytes is also used by
+the parallel run workers of data_preprocessing/preprocessing.py.
+'''
+import os
+
+
+def usable_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory_bytes():
+    '''
+    Memory that new processes can use without swapping.
+
+    :return: bytes (MemAvailable on Linux, free physical pages elsewhere), None if unknown
+    '''
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def worker_count(num_units, unit_bytes, max_workers=None, memory_fraction=0.8):
+    '''
+    Number of scheduler workers.
+
+    :param num_units: number of units to run
+    :param unit_bytes: estimated peak memory of the largest unit
+    :param max_workers: fixed upper limit, None to use every usable core
+    :param memory_fraction: share of the available memory the workers may use together
+    :return: worker count, at least 1
+    '''
+    workers = min(max_workers or usable_cores(), max(num_units, 1))
+    available = available_memory_bytes()
+    if available is not None and unit_bytes > 0:
+        workers = min(workers, int(available * memory_fraction // unit_bytes))
+    return max(workers, 1)
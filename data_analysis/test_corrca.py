@@ -0,0 +1,69 @@
+'''
+CorrCA on a synthetic cohort with one shared source.
+
+    python -m pytest -q test_corrca.py
+'''
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from corrca import corrca_covariances, corrca_solve
+
+N_CHANNELS = 8
+N_SAMPLES = 5000
+N_SUBJECTS = 5
+# norm of the source pattern, with unit subject noise the filtered SNR is its square
+PATTERN_NORM = 3.0
+
+
+def synthetic_cohort(seed=0):
+    # the same source projected through the same pattern in every subject, plus subject noise
+    rng = np.random.default_rng(seed)
+    source = rng.standard_normal(N_SAMPLES)
+    pattern = rng.standard_normal(N_CHANNELS)
+    pattern *= PATTERN_NORM / np.linalg.norm(pattern)
+    subjects = [np.outer(pattern, source) + rng.standard_normal((N_CHANNELS, N_SAMPLES))
+                for _ in range(N_SUBJECTS)]
+    return subjects, source, pattern
+
+
+def test_streaming_covariances_match_direct():
+    subjects, _, _ = synthetic_cohort()
+    within, between, n_subjects = corrca_covariances(iter(subjects))
+
+    centered = [data - data.mean(axis=1, keepdims=True) for data in subjects]
+    expected_between = sum(a @ b.T for a in centered for b in centered) - sum(a @ a.T for a in centered)
+
+    assert n_subjects == N_SUBJECTS
+    np.testing.assert_allclose(within, sum(a @ a.T for a in centered))
+    np.testing.assert_allclose(between, expected_between)
+
+
+def test_recovers_shared_source():
+    subjects, source, pattern = synthetic_cohort()
+    within, between, n_subjects = corrca_covariances(subjects)
+    isc, filters, forward = corrca_solve(within, between, n_subjects, shrinkage=0)
+
+    assert np.all(np.diff(isc) <= 1e-12)
+    # signal variance over signal plus noise variance of the optimal filter
+    assert isc[0] == pytest.approx(PATTERN_NORM**2 / (PATTERN_NORM**2 + 1), abs=0.03)
+    assert np.all(np.abs(isc[1:]) < 0.05)
+
+    components = [filters[:, 0] @ data for data in subjects]
+    # single subjects keep their noise, the cohort mean of the component follows the source
+    assert abs(np.corrcoef(np.mean(components, axis=0), source)[0, 1]) > 0.95
+    assert abs(np.corrcoef(forward[:, 0], pattern)[0, 1]) > 0.99
+
+    # the component ISC is the mean pairwise correlation of the component time courses
+    pairwise = np.mean([np.corrcoef(a, b)[0, 1] for a, b in combinations(components, 2)])
+    assert isc[0] == pytest.approx(pairwise, abs=0.01)
+
+
+def test_needs_two_subjects():
+    subjects, _, _ = synthetic_cohort()
+    within, between, n_subjects = corrca_covariances(subjects[:1])
+    with pytest.raises(ValueError):
+        corrca_solve(within, between, n_subjects)
+    with pytest.raises(ValueError):
+        corrca_covariances([])
@@ -0,0 +1,87 @@
+'''
+Incremental leave-one-out cohort: growing the cohort by one subject must give the same
+results as a full recompute, and the stored cohort sum must survive setting changes that
+do not affect it.
+
+    python -m pytest -q test_incremental_cohort.py
+'''
+import numpy as np
+import pytest
+
+pytest.importorskip("mne")
+import isc_analysis as isc
+
+CHANNELS = ["E1", "E2", "E3"]
+N_SAMPLES = 600
+
+
+def synthetic_band_data(subjects, seed=0):
+    rng = np.random.default_rng(seed)
+    common = rng.standard_normal((len(CHANNELS), N_SAMPLES))
+    band_data = {}
+    for subj in subjects:
+        data = (0.6 * common + 0.8 * rng.standard_normal((len(CHANNELS), N_SAMPLES))).astype(np.float32)
+        band_data[subj] = {
+            'electrode_data': {ch: data[i] for i, ch in enumerate(CHANNELS)},
+            'event_data': {
+                'event_groups': [{'group_id': 1, 'rows_sample': 0, 'rowe_sample': N_SAMPLES}],
+                'sfreq': 100.0,
+                'fingerprint': subj,
+            },
+            'input_fingerprint': subj,
+        }
+    return band_data
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    monkeypatch.setattr(isc, "NUM_SHUFFLES", 20)
+    monkeypatch.setattr(isc, "NOISE_SEED", 5)
+    monkeypatch.setattr(isc, "INCREMENTAL_COHORT", True)
+
+
+def test_added_subject_matches_full_recompute(settings, tmp_path):
+    subjects = ["s1", "s2", "s3", "s4"]
+    band_data = synthetic_band_data(subjects)
+
+    incremental_dir = tmp_path / "incremental"
+    full_dir = tmp_path / "full"
+    incremental_dir.mkdir()
+    full_dir.mkdir()
+
+    isc.calculate_leave_one_out_band("ses", "run", "Alpha", band_data, subjects[:3], str(incremental_dir))
+    sum_paths = isc.cohort_sum_paths(str(incremental_dir), "ses", "run", "Alpha")
+    stored = isc.load_cohort_sum(sum_paths, band_data, subjects, CHANNELS)
+    assert stored is not None and stored["subjects"] == subjects[:3]
+
+    incremental = isc.calculate_leave_one_out_band("ses", "run", "Alpha", band_data, subjects, str(incremental_dir))
+    full = isc.calculate_leave_one_out_band("ses", "run", "Alpha", band_data, subjects, str(full_dir))
+
+    for subj in subjects:
+        for ch in CHANNELS:
+            inc_ch = incremental[subj]["correlation"][ch]
+            full_ch = full[subj]["correlation"][ch]
+            assert inc_ch["original"]["r"] == pytest.approx(full_ch["original"]["r"], abs=1e-12)
+            assert inc_ch["random"]["p_fwer"] == full_ch["random"]["p_fwer"]
+            assert inc_ch["noise"]["r"] == pytest.approx(full_ch["noise"]["r"], abs=1e-12)
+
+    np.testing.assert_allclose(np.load(sum_paths[0]),
+                               np.load(isc.cohort_sum_paths(str(full_dir), "ses", "run", "Alpha")[0]))
+
+
+def test_cohort_sum_kept_across_permutation_settings(settings, monkeypatch, tmp_path):
+    subjects = ["s1", "s2", "s3"]
+    band_data = synthetic_band_data(subjects)
+    isc.calculate_leave_one_out_band("ses", "run", "Alpha", band_data, subjects, str(tmp_path))
+    sum_paths = isc.cohort_sum_paths(str(tmp_path), "ses", "run", "Alpha")
+
+    monkeypatch.setattr(isc, "NUM_SHUFFLES", 30)
+    monkeypatch.setattr(isc, "SIGNIFICANCE_METHOD", "fdr")
+    assert isc.load_cohort_sum(sum_paths, band_data, subjects, CHANNELS) is not None
+
+    monkeypatch.setattr(isc, "LOW_MEMORY", True)
+    assert isc.load_cohort_sum(sum_paths, band_data, subjects, CHANNELS) is None
+
+    monkeypatch.setattr(isc, "LOW_MEMORY", False)
+    band_data["s2"]["input_fingerprint"] = "s2-changed"
+    assert isc.load_cohort_sum(sum_paths, band_data, subjects, CHANNELS) is None
@@ -0,0 +1,37 @@
+'''
+The running-sum sliding-window ISC must match np.corrcoef in every window.
+
+    python -m pytest -q test_sliding_window.py
+'''
+import numpy as np
+import pytest
+
+pytest.importorskip("mne")
+import isc_analysis as isc
+
+
+def windowed_corrcoef(x, y, window_size, step):
+    starts = np.arange(0, x.shape[-1] - window_size + 1, step)
+    r = np.array([[np.corrcoef(x[ch, s:s + window_size], y[ch, s:s + window_size])[0, 1] for s in starts]
+                  for ch in range(x.shape[0])])
+    return r, starts
+
+
+@pytest.mark.parametrize("window_size, step", [(50, 1), (64, 7), (300, 300)])
+def test_matches_corrcoef(window_size, step):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((3, 300)) + 100  # offset, the running sums must not lose precision
+    y = 0.5 * x + rng.standard_normal((3, 300))
+
+    r, starts = isc.sliding_window_correlation(x, y, window_size, step)
+    expected_r, expected_starts = windowed_corrcoef(x, y, window_size, step)
+
+    np.testing.assert_array_equal(starts, expected_starts)
+    np.testing.assert_allclose(r, expected_r, atol=1e-10)
+
+
+def test_flat_window_gives_zero():
+    x = np.ones((1, 100))
+    y = np.random.default_rng(1).standard_normal((1, 100))
+    r, _ = isc.sliding_window_correlation(x, y, 20, 10)
+    assert np.all(r == 0)
@@ -0,0 +1,63 @@
+'''
+The vectorized window noise must follow the same distribution as the sequential window loop.
+
+    python -m pytest -q test_window_noise.py
+'''
+import numpy as np
+import pytest
+
+pytest.importorskip("mne")
+import isc_analysis as isc
+
+SFREQ = 100.0
+N_SAMPLES = 203
+N_DRAWS = 4000
+
+
+def sequential_window_noise(signal_data, sfreq, rng):
+    # the original per-window loop, run on every row of signal_data at once
+    window_size = max(int(0.1 * sfreq), 10)
+    overlap = int(window_size * 0.5)
+    noise = np.zeros_like(signal_data)
+    n_samples = signal_data.shape[-1]
+    start = 0
+    while start < n_samples:
+        end = min(start + window_size, n_samples)
+        window_data = signal_data[..., start:end]
+        local_mean = np.mean(window_data, axis=-1, keepdims=True)
+        local_std = np.maximum(np.std(window_data, axis=-1, keepdims=True), 1e-6)
+        window_noise = rng.normal(local_mean, local_std, size=window_data.shape)
+        if start == 0:
+            noise[..., start:end] = window_noise
+        else:
+            noise[..., start:end] = (noise[..., start:end] + window_noise) / 2
+        start += window_size - overlap
+    return noise
+
+
+def test_matches_sequential_distribution():
+    rng = np.random.default_rng(0)
+    # changing level and spread so neighbouring windows differ
+    signal = np.linspace(-2, 3, N_SAMPLES) + rng.standard_normal(N_SAMPLES) * np.linspace(0.2, 2, N_SAMPLES)
+    draws = np.broadcast_to(signal, (N_DRAWS, N_SAMPLES))
+
+    vectorized = isc.generate_window_noise(draws, SFREQ, np.random.default_rng(1))
+    sequential = sequential_window_noise(draws, SFREQ, np.random.default_rng(2))
+
+    std = sequential.std(axis=0)
+    # five standard errors of the per-sample mean and standard deviation
+    np.testing.assert_array_less(np.abs(vectorized.mean(axis=0) - sequential.mean(axis=0)),
+                                 5 * std * np.sqrt(2 / N_DRAWS))
+    np.testing.assert_array_less(np.abs(vectorized.std(axis=0) - std), 5 * std / np.sqrt(N_DRAWS))
+
+
+def test_seeded_noise_is_reproducible():
+    rng = np.random.default_rng(3)
+    signal = rng.standard_normal((3, N_SAMPLES))
+
+    batch = isc.generate_window_noise(signal, SFREQ, np.random.default_rng(4))
+    repeat = isc.generate_window_noise(signal, SFREQ, np.random.default_rng(4))
+
+    assert batch.shape == signal.shape
+    np.testing.assert_array_equal(batch, repeat)
+    assert isc.generate_window_noise(signal[0], SFREQ, np.random.default_rng(4)).shape == (N_SAMPLES,)
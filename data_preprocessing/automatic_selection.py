@@ -0,0 +1,169 @@
+'''
+Automatic bad channel and ICA component selection for the headless mode of preprocessing.py.
+
+Bad channels are found from three robust statistics of the filtered data:
+- amplitude: robust z-score (median / MAD over channels) of the channel standard deviation
+- flatness: standard deviation below an absolute floor
+- correlation: in short windows, the highest absolute correlation with any other channel;
+  a channel is bad when that stays below a threshold in too many windows
+
+ICA components are excluded when their sources look like ocular or cardiac activity.
+Ocular scores come from mne's find_bads_eog with periocular EEG channels as EOG proxies
+(the EGI net has no EOG channel). Cardiac scores come from the periodicity of the
+rectified source at heart-rate lags, z-scored over components, since there is no ECG
+channel either.
+'''
+import numpy as np
+
+# periocular electrodes of the GSN-HydroCel-128 net, used as EOG proxies
+EOG_PROXY_CHANNELS = ['E8', 'E14', 'E21', 'E25', 'E125', 'E126', 'E127', 'E128']
+
+# heart-rate lag range searched for cardiac periodicity, 40 to 150 beats per minute
+HEART_RATE_LAGS = (0.4, 1.5)
+
+# lowest cardiac score that can be excluded, keeps the z-score from picking noise when no source is cardiac
+CARDIAC_MIN_SCORE = 0.1
+
+
+def robust_zscore(values):
+    values = np.asarray(values, dtype=float)
+    median = np.median(values)
+    mad = 1.4826 * np.median(np.abs(values - median))
+    if mad == 0:
+        return np.zeros_like(values)
+    return (values - median) / mad
+
+
+def window_max_correlation(data, window):
+    '''
+    Highest absolute correlation of every channel with any other channel, per window.
+
+    :param data: array of shape (n_channels, n_samples)
+    :param window: window length in samples
+    :return: array of shape (n_channels, n_windows), 0 for channels that are flat in a window
+    '''
+    n_channels, n_samples = data.shape
+    n_windows = n_samples // window
+    max_corr = np.zeros((n_channels, n_windows))
+    for i in range(n_windows):
+        segment = data[:, i * window:(i + 1) * window]
+        segment = segment - segment.mean(axis=1, keepdims=True)
+        norm = np.sqrt(np.sum(segment**2, axis=1))
+        valid = norm > 0
+        if np.count_nonzero(valid) < 2:
+            continue
+        normed = segment[valid] / norm[valid, None]
+        corr = np.abs(normed @ normed.T)
+        np.fill_diagonal(corr, 0)
+        max_corr[valid, i] = corr.max(axis=1)
+    return max_corr
+
+
+def bad_channel_scores(data, sfreq, z_threshold=5.0, flat_threshold=1e-7, corr_threshold=0.4,
+                       bad_window_fraction=0.01, window_seconds=1.0):
+    '''
+    Score every channel and mark the bad ones.
+
+    :param data: array of shape (n_channels, n_samples), in volts
+    :param sfreq: sampling frequency
+    :param z_threshold: robust z-score of the standard deviation above which a channel is too noisy
+    :param flat_threshold: standard deviation below which a channel is flat
+    :param corr_threshold: window correlation below which a channel is uncorrelated in that window
+    :param bad_window_fraction: fraction of uncorrelated windows above which a channel is bad
+    :param window_seconds: length of the correlation windows
+    :return: (bad index array, {criterion: per-channel scores}, {criterion: bad index array})
+    '''
+    data = np.asarray(data, dtype=float)
+    std = data.std(axis=1)
+    amplitude_z = robust_zscore(std)
+    window = max(int(round(window_seconds * sfreq)), 2)
+    uncorrelated = np.mean(window_max_correlation(data, window) < corr_threshold, axis=1) \
+        if data.shape[1] >= window else np.zeros(len(std))
+
+    criteria = {
+        'flat': np.flatnonzero(std < flat_threshold),
+        'amplitude': np.flatnonzero(np.abs(amplitude_z) > z_threshold),
+        'correlation': np.flatnonzero(uncorrelated > bad_window_fraction),
+    }
+    scores = {'std': std, 'amplitude_z': amplitude_z, 'uncorrelated_fraction': uncorrelated}
+    bad = np.unique(np.concatenate(list(criteria.values()))).astype(int)
+    return bad, scores, criteria
+
+
+def detect_bad_channels(raw, z_threshold=5.0, flat_threshold=1e-7, corr_threshold=0.4, bad_window_fraction=0.01):
+    '''
+    Bad EEG channels of a raw object, channels already in raw.info['bads'] are kept.
+
+    :return: (sorted list of bad channel names, {criterion: list of channel names})
+    '''
+    picks = [ch for ch in raw.ch_names if ch not in raw.info['bads']]
+    data = raw.get_data(picks=picks, reject_by_annotation='omit')
+    bad, _, criteria = bad_channel_scores(data, raw.info['sfreq'], z_threshold=z_threshold,
+                                          flat_threshold=flat_threshold, corr_threshold=corr_threshold,
+                                          bad_window_fraction=bad_window_fraction)
+    reasons = {name: [picks[i] for i in idx] for name, idx in criteria.items()}
+    bads = sorted(set(raw.info['bads']) | {picks[i] for i in bad})
+    return bads, reasons
+
+
+def cardiac_scores(sources, sfreq, lags=HEART_RATE_LAGS):
+    '''
+    Cardiac-likeness of ICA sources.
+
+    The score of a source is the highest normalized autocorrelation of its rectified,
+    standardized signal at heart-rate lags; QRS complexes give a sharp peak there.
+
+    :param sources: array of shape (n_components, n_samples)
+    :return: array of shape (n_components,)
+    '''
+    sources = np.asarray(sources, dtype=float)
+    std = sources.std(axis=1, keepdims=True)
+    rectified = np.abs((sources - sources.mean(axis=1, keepdims=True)) / np.where(std > 0, std, 1))
+    rectified -= rectified.mean(axis=1, keepdims=True)
+
+    n_samples = rectified.shape[1]
+    n_fft = 1 << int(np.ceil(np.log2(2 * n_samples)))
+    spectrum = np.fft.rfft(rectified, n=n_fft, axis=1)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), n=n_fft, axis=1)[:, :n_samples]
+    zero_lag = autocorr[:, :1]
+    autocorr = np.divide(autocorr, zero_lag, out=np.zeros_like(autocorr), where=zero_lag > 0)
+
+    start = int(lags[0] * sfreq)
+    stop = min(int(lags[1] * sfreq) + 1, n_samples)
+    if stop <= start:
+        return np.zeros(len(sources))
+    return autocorr[:, start:stop].max(axis=1)
+
+
+def select_ica_components(ica, raw, eog_channels=EOG_PROXY_CHANNELS, eog_threshold=3.0, ecg_threshold=3.0):
+    '''
+    ICA components to exclude as ocular or cardiac artifacts.
+
+    :param ica: fitted mne ICA
+    :param raw: raw object the ICA was fitted on
+    :param eog_channels: EEG channels used as EOG proxies, missing or bad ones are skipped
+    :param eog_threshold: z-score threshold of find_bads_eog
+    :param ecg_threshold: robust z-score of cardiac_scores above which a component is excluded,
+                          the score itself must also exceed CARDIAC_MIN_SCORE
+    :return: (sorted list of component indices, {'eog': [...], 'ecg': [...], 'eog_scores': ..., 'ecg_scores': ...})
+    '''
+    eog_channels = [ch for ch in eog_channels if ch in raw.ch_names and ch not in raw.info['bads']]
+    eog_idx, eog_scores = [], []
+    if eog_channels:
+        eog_idx, eog_scores = ica.find_bads_eog(raw, ch_name=eog_channels, threshold=eog_threshold,
+                                                 reject_by_annotation=True)
+        # one score array per proxy channel, keep the strongest per component
+        eog_scores = np.max(np.abs(np.atleast_2d(eog_scores)), axis=0)
+
+    sources = ica.get_sources(raw).get_data(reject_by_annotation='omit')
+    ecg_scores = cardiac_scores(sources, raw.info['sfreq'])
+    ecg_idx = np.flatnonzero((robust_zscore(ecg_scores) > ecg_threshold) & (ecg_scores > CARDIAC_MIN_SCORE))
+
+    exclude = sorted({int(i) for i in eog_idx} | {int(i) for i in ecg_idx})
+    details = {
+        'eog': sorted(int(i) for i in eog_idx),
+        'ecg': [int(i) for i in ecg_idx],
+        'eog_scores': [round(float(s), 4) for s in eog_scores],
+        'ecg_scores': [round(float(s), 4) for s in ecg_scores],
+    }
+    return exclude, details
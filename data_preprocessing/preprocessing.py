@@ -11,11 +11,32 @@ https://github.com/ncclab-sustech/ListeningEEG/blob/main/data_preprocessing/READ
 '''
 
 
+import os
+import sys
 import mne
 from mne.preprocessing import ICA
 import numpy as np
 import argparse
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from convert_eeg_to_bids import convert_to_bids
+from automatic_selection import detect_bad_channels, select_ica_components, EOG_PROXY_CHANNELS
+from stage_cache import input_fingerprint, stage_key, cached_raw, cached_ica
+
+# the memory probe is shared with the ISC unit scheduler in data_analysis
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data_analysis"))
+from isc_scheduler import available_memory_bytes
+
+# Peak memory of one run in process_single_run, as a multiple of the run segment size
+# (resampling, filtering, interpolation, ICA sources and the RawArray copies of create_new_raw)
+RUN_MEMORY_FACTOR = 6
+
+# Fraction of the available memory the run workers may use when no --memory_budget is given
+MEMORY_FRACTION = 0.8
+
+# Lock serializing the BIDS writes of parallel run workers, set by init_run_worker
+BIDS_LOCK = None
 
 
 def get_chapter_events(raw):
@@ -36,18 +57,17 @@ def get_chapter_events(raw):
     return chapter_events
 
 
-def segment_runs(raw, chapter_events, run_definitions, remaining_time_at_beginning=5):
+def run_boundaries(raw, chapter_events, run_definitions, remaining_time_at_beginning=5):
     """
-    Segments the raw data into runs based on chapter events and run definitions.
+    Finds the time range of every run based on chapter events and run definitions.
 
     :param raw: MNE Raw object
     :param chapter_events: List of tuples containing (chapter_number, onset_time)
     :param run_definitions: Dictionary defining chapters for each run {run_number: (start_chap, end_chap)}
     :param remaining_time_at_beginning: Time to include before the start of the first chapter
-    :return: List of tuples containing (run_number, raw_segment, crop_start_time)
+    :return: List of tuples containing (run_number, start_onset, end_onset)
     """
-    runs = []
-    sfreq = raw.info['sfreq']  # Sampling frequency
+    boundaries = []
 
 
     for run_num, (start_chap, end_chap) in run_definitions.items():
@@ -83,11 +103,126 @@ def segment_runs(raw, chapter_events, run_definitions, remaining_time_at_beginni
             print(f"Run {run_num}: end_onset {end_onset} exceeds max_onset {max_onset}. Adjusting to max_onset.")
             end_onset = max_onset
 
+        boundaries.append((run_num, start_onset, end_onset))
+
+    return boundaries
+
+
+def crop_run(raw, tmin, tmax):
+    """
+    Cuts one run out of a recording without copying the whole recording.
+
+    A raw that is not preloaded is copied without data, cropped and then only the run is
+    read from the file. A preloaded raw is sliced to the run's samples, and only that
+    slice is copied, since the later steps modify the run data in place.
+
+    :param raw: MNE Raw object of the whole recording
+    :return: preloaded MNE Raw object of the run
+    """
+    if not raw.preload:
+        return raw.copy().crop(tmin=tmin, tmax=tmax).load_data()
+
+    # same sample rounding as Raw.crop
+    sfreq = raw.info['sfreq']
+    start = max(int(round(tmin * sfreq)), 0)
+    stop = min(int(round(tmax * sfreq)), raw.n_times - 1) + 1
+    run_raw = mne.io.RawArray(raw.get_data(start=start, stop=stop), raw.info,
+                              first_samp=raw.first_samp + start, verbose=False)
+    # annotations keep the recording time base, as after Raw.crop
+    run_raw.set_annotations(raw.annotations)
+    return run_raw
+
+
+def segment_runs(raw, chapter_events, run_definitions, remaining_time_at_beginning=5, boundaries=None):
+    """
+    Segments the raw data into runs based on chapter events and run definitions.
+
+    Runs are cut one at a time when the caller asks for them, so only one run
+    segment is held next to the recording.
+
+    :param boundaries: run_boundaries output if the caller already has it
+    :return: Generator of tuples containing ((run_number, start_onset, end_onset), raw_segment)
+    """
+    if boundaries is None:
+        boundaries = run_boundaries(raw, chapter_events, run_definitions, remaining_time_at_beginning)
+    for boundary in boundaries:
+        _, start_onset, end_onset = boundary
         # Crop the raw data for the run
-        run_raw = raw.copy().crop(tmin=start_onset, tmax=end_onset)
-        runs.append((run_num, run_raw, start_onset))
+        yield boundary, crop_run(raw, start_onset, end_onset)
+
 
-    return runs
+def run_worker_count(n_runs, run_bytes, n_jobs=None, memory_budget=None):
+    """
+    Number of run workers that fit the CPU and memory budget.
+
+    :param n_runs: number of runs to process
+    :param run_bytes: size of the largest run segment in bytes
+    :param n_jobs: maximum number of workers, None for all cores
+    :param memory_budget: bytes the workers may use together, None for MEMORY_FRACTION of the available memory
+    :return: number of workers, at least 1
+    """
+    workers = min(n_jobs or os.cpu_count() or 1, n_runs)
+    if memory_budget is None:
+        available = available_memory_bytes()
+        memory_budget = available * MEMORY_FRACTION if available else None
+    if memory_budget is not None and run_bytes > 0:
+        workers = min(workers, int(memory_budget // (run_bytes * RUN_MEMORY_FACTOR)))
+    return max(1, workers)
+
+
+def init_run_worker(lock):
+    global BIDS_LOCK
+    BIDS_LOCK = lock
+
+
+def write_bids(raw, **kwargs):
+    # runs of one subject share scans.tsv, participants.tsv and the dataset description
+    with BIDS_LOCK if BIDS_LOCK is not None else nullcontext():
+        convert_to_bids(raw, **kwargs)
+
+
+def process_runs_parallel(raw, boundaries, args, n_workers, filtered=None, base_key=None):
+    """
+    Process runs in a pool of worker processes.
+
+    Each run is cropped only when a worker is free, so the parent holds at most
+    n_workers segments besides the recording, and every worker receives only its own segment.
+
+    :param boundaries: List of tuples containing (run_number, start_onset, end_onset)
+    :param filtered: filter_recording output, its runs are sent along with the raw segments
+    :param base_key: stage cache key of the recording the runs are cut from (of filtered when given)
+    """
+    pending = list(boundaries)
+    running = {}
+    failed = []
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_run_worker,
+                             initargs=(multiprocessing.Lock(),)) as executor:
+        while pending or running:
+            while pending and len(running) < n_workers:
+                run_num, start_onset, end_onset = pending.pop(0)
+                run_raw = crop_run(raw, start_onset, end_onset)
+                run_filtered, crop_start_time = None, start_onset
+                if filtered is not None:
+                    run_filtered, crop_start_time = crop_filtered_run(filtered, start_onset, end_onset)
+                run_key = stage_key('run', base_key, {'tmin': start_onset, 'tmax': end_onset})
+                future = executor.submit(process_single_run, run_num, run_raw, crop_start_time, args,
+                                         run_output_root=args.processed_data_root, filtered_raw=run_filtered,
+                                         run_key=run_key)
+                running[future] = run_num
+                del run_raw, run_filtered
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                run_num = running.pop(future)
+                try:
+                    future.result()
+                    print(f'-------------------- Run {run_num} finished --------------------')
+                except Exception as e:
+                    print(f'Run {run_num} failed: {e!r}')
+                    failed.append(run_num)
+
+    if failed:
+        raise RuntimeError(f"Runs failed: {failed}")
 
 
 
@@ -170,23 +305,48 @@ def create_new_raw(raw, crop_time_at_beginning, montage_name='GSN-HydroCel-128',
 
 
 
-def process_single_run(run_num, raw, crop_start_time, args, run_output_root):
+def filter_recording(raw, args):
     '''
-    Process and save a single run of EEG data.
+    Interpolate, resample, notch and band pass filter the whole recording once.
 
-    :param run_num: The run number (e.g., 1 or 2)
-    :param raw: MNE Raw object for the run
-    :param crop_start_time: Time to crop from the beginning
-    :param args: Parsed command-line arguments
-    :param run_output_root: Root directory to save the run data
-    '''
-    print(f'-------------------- Processing Run {run_num} --------------------')
+    These steps are linear and the same for every run, so doing them before segmentation
+    gives the same runs without refiltering the chapter boundaries runs share, and without
+    filter edge artifacts at the start of each run.
 
-    convert_to_bids(raw, ica_component=None, ica_topo_figs=None, ica_dict=None, bad_channel_dict=None,
-                    sub_id=args.sub_id, ses=args.ses, task=args.task, run=run_num,
-                    bids_root=args.raw_data_root, dataset_name=args.dataset_name,
-                    dataset_type='raw', author=args.author, line_freq=args.line_freq)
+    :return: a filtered copy of raw
+    '''
+    filtered = raw.copy()
+    if not filtered.preload:
+        filtered.load_data()
+    filtered.info["bads"].extend(args.bad_channels)
+    filtered.interpolate_bads()
+    print('-------------------- recording interpolated --------------------')
+    filtered.resample(args.resample_freq)
+    print('-------------------- recording resampled --------------------')
+    filtered.notch_filter(freqs=(args.line_freq))
+    print('-------------------- recording notch filter finished --------------------')
+    filtered.filter(l_freq=args.low_pass_freq, h_freq=args.high_pass_freq)
+    print('-------------------- recording band pass filter finished --------------------')
+    return filtered
+
+
+def filter_params(args):
+    # every argument that changes the output of filter_recording or filter_run
+    return {
+        'bad_channels': sorted(args.bad_channels),
+        'resample_freq': args.resample_freq,
+        'line_freq': args.line_freq,
+        'low_pass_freq': args.low_pass_freq,
+        'high_pass_freq': args.high_pass_freq,
+    }
+
+
+def filter_run(raw, args):
+    '''
+    Interpolate, resample, notch and band pass filter one run in place.
 
+    :return: the filtered raw
+    '''
     raw.info["bads"].extend(args.bad_channels)
     raw = raw.interpolate_bads()
 
@@ -203,12 +363,59 @@ def process_single_run(run_num, raw, crop_start_time, args, run_output_root):
     # Band pass filter
     raw = raw.filter(l_freq=args.low_pass_freq, h_freq=args.high_pass_freq)
     print('-------------------- band pass filter finished --------------------')
+    return raw
+
+
+def fit_ica(raw, args):
+    ica = ICA(n_components=args.ica_n_components, max_iter='auto', method=args.ica_method, random_state=97)
+    ica.fit(raw, reject_by_annotation=True)
+    return ica
+
+
+def crop_filtered_run(filtered, start_onset, end_onset):
+    '''
+    Cut one run out of the filtered recording.
+
+    :return: (filtered run segment, its actual start time on the resampled grid)
+    '''
+    run_filtered = crop_run(filtered, start_onset, end_onset)
+    return run_filtered, run_filtered.first_time - filtered.first_time
+
+
+def process_single_run(run_num, raw, crop_start_time, args, run_output_root, filtered_raw=None, run_key=None):
+    '''
+    Process and save a single run of EEG data.
+
+    :param run_num: The run number (e.g., 1 or 2)
+    :param raw: MNE Raw object for the run
+    :param crop_start_time: Time to crop from the beginning
+    :param args: Parsed command-line arguments
+    :param run_output_root: Root directory to save the run data
+    :param filtered_raw: the run cut from filter_recording output, skips interpolation, resampling
+                         and filtering of raw; crop_start_time must then be its start time
+    :param run_key: stage cache key of the run segment (of filtered_raw when given), None disables the cache
+    '''
+    print(f'-------------------- Processing Run {run_num} --------------------')
+
+    write_bids(raw, ica_component=None, ica_topo_figs=None, ica_dict=None, bad_channel_dict=None,
+                    sub_id=args.sub_id, ses=args.ses, task=args.task, run=run_num,
+                    bids_root=args.raw_data_root, dataset_name=args.dataset_name,
+                    dataset_type='raw', author=args.author, line_freq=args.line_freq)
+
+    if filtered_raw is not None:
+        # Interpolated, resampled and filtered once for the whole recording
+        raw = filtered_raw
+        filtered_key = run_key
+    else:
+        filtered_key = stage_key('filtered', run_key, filter_params(args))
+        run_raw = raw
+        raw = cached_raw(args.cache_dir, 'filtered', filtered_key, lambda: filter_run(run_raw, args))
 
     # Create new raw with adjusted annotations
     filt_raw = create_new_raw(raw=raw, crop_time_at_beginning=crop_start_time,
                               montage_name=args.montage_name, preload=False)
 
-    convert_to_bids(filt_raw, ica_component=None, ica_topo_figs=None, ica_dict=None,
+    write_bids(filt_raw, ica_component=None, ica_topo_figs=None, ica_dict=None,
                     bad_channel_dict=None, sub_id=args.sub_id, ses=args.ses,
                     task=args.task, run=run_num, bids_root=args.filtered_data_root,
                     dataset_name=args.dataset_name, dataset_type='derivative',
@@ -216,30 +423,47 @@ def process_single_run(run_num, raw, crop_start_time, args, run_output_root):
 
     print('-------------------- filtering finished --------------------')
 
-    # Plot to mark bad electrodes
-    raw.plot(block=True)
+    if args.headless:
+        # Detect bad electrodes from amplitude, flatness and correlation statistics
+        raw.info['bads'], bad_reasons = detect_bad_channels(
+            raw, z_threshold=args.bad_z_threshold, flat_threshold=args.flat_threshold,
+            corr_threshold=args.bad_corr_threshold, bad_window_fraction=args.bad_window_fraction)
+    else:
+        # Plot to mark bad electrodes
+        raw.plot(block=True)
 
     bad_channels = raw.info['bads']
     print('bad_channels: ', bad_channels)
 
     bad_channel_dict = {'bad channels': bad_channels}
+    if args.headless:
+        bad_channel_dict.update({'method': 'automatic', 'criteria': bad_reasons})
 
     # Bad channel interpolation
-    raw = raw.interpolate_bads()
+    interpolated_key = stage_key('interpolated', filtered_key, {'bad_channels': sorted(bad_channels)})
+    raw = cached_raw(args.cache_dir, 'interpolated', interpolated_key, raw.interpolate_bads)
     print('-------------------- bad channels interpolated --------------------')
 
     # raw.set_annotations(Annotations([], [], []))
     # ICA
-    ica = ICA(n_components=args.ica_n_components, max_iter='auto', method=args.ica_method, random_state=97)
-    ica.fit(raw, reject_by_annotation=True)
+    ica_key = stage_key('ica', interpolated_key, {'n_components': args.ica_n_components,
+                                                  'method': args.ica_method, 'random_state': 97})
+    ica = cached_ica(args.cache_dir, ica_key, lambda: fit_ica(raw, args))
 
     ica_components = ica.get_sources(raw).get_data()
-    ica.plot_sources(raw, show_scrollbars=False, block=True)
-    ica_topo_figs = ica.plot_components()
+    if args.headless:
+        ica.exclude, ica_scores = select_ica_components(ica, raw, eog_channels=args.eog_channels,
+                                                        eog_threshold=args.eog_threshold,
+                                                        ecg_threshold=args.ecg_threshold)
+    else:
+        ica.plot_sources(raw, show_scrollbars=False, block=True)
+    ica_topo_figs = ica.plot_components(show=not args.headless)
 
     print('exclude ICA components: ', ica.exclude)
 
     ica_dict = {'shape': ica_components.shape, 'exclude': ica.exclude}
+    if args.headless:
+        ica_dict.update({'method': 'automatic', **ica_scores})
 
     ica.apply(raw)
     print('-------------------- ICA finished --------------------')
@@ -249,13 +473,14 @@ def process_single_run(run_num, raw, crop_start_time, args, run_output_root):
     print('-------------------- rereference finished --------------------')
 
     # Plot final data
-    raw.plot(block=True)
+    if not args.headless:
+        raw.plot(block=True)
 
     # Create preprocessed raw
     preproc_raw = create_new_raw(raw=raw, crop_time_at_beginning=crop_start_time,
                                  montage_name=args.montage_name, preload=False)
 
-    convert_to_bids(preproc_raw, ica_component=ica_components, ica_topo_figs=ica_topo_figs,
+    write_bids(preproc_raw, ica_component=ica_components, ica_topo_figs=ica_topo_figs,
                     ica_dict=ica_dict, bad_channel_dict=bad_channel_dict, sub_id=args.sub_id,
                     ses=args.ses, task=args.task, run=run_num, bids_root=args.processed_data_root,
                     dataset_name=args.dataset_name, dataset_type='derivative',
@@ -269,7 +494,8 @@ def process_eeg_segments(eeg_path, args):
     :param eeg_path: Path to the EEG .mff file
     :param args: Parsed command-line arguments
     """
-    raw = read_mff_file(eeg_path=eeg_path, montage_name=args.montage_name, preload=True)
+    # Not preloaded, every run is read from the file when it is processed
+    raw = read_mff_file(eeg_path=eeg_path, montage_name=args.montage_name, preload=False)
 
     # Get all chapter events
     chapter_events = get_chapter_events(raw)
@@ -322,16 +548,52 @@ def process_eeg_segments(eeg_path, args):
             
         }
 
-    # Segment the runs
-    runs = segment_runs(raw, chapter_events, run_definitions,
-                        remaining_time_at_beginning=args.remaining_time_at_beginning)
+    boundaries = run_boundaries(raw, chapter_events, run_definitions,
+                                remaining_time_at_beginning=args.remaining_time_at_beginning)
 
-    if not runs:
+    if not boundaries:
         print("No runs to process. Exiting.")
         return
 
-    for run_num, run_raw, crop_start_time in runs:
-        process_single_run(run_num, run_raw, crop_start_time, args, run_output_root=args.processed_data_root)
+    n_workers = 1
+    if args.n_jobs != 1:
+        if args.headless:
+            # preloaded data is float64
+            run_bytes = max(end - start for _, start, end in boundaries) * raw.info['sfreq'] * len(raw.ch_names) * 8
+            memory_budget = args.memory_budget * 2**30 if args.memory_budget else None
+            n_workers = run_worker_count(len(boundaries), run_bytes, n_jobs=args.n_jobs or None,
+                                         memory_budget=memory_budget)
+        else:
+            print("Parallel runs need --headless, the GUI stages cannot run in worker processes. Running serially.")
+
+    base_key = None
+    if args.cache_dir:
+        base_key = stage_key('recording', input_fingerprint(eeg_path),
+                             {'montage_name': args.montage_name, 'mne': mne.__version__})
+
+    filtered = None
+    if args.filter_whole_recording:
+        base_key = stage_key('filtered_recording', base_key, filter_params(args))
+        filtered = cached_raw(args.cache_dir, 'filtered_recording', base_key, lambda: filter_recording(raw, args))
+
+    if n_workers > 1:
+        print(f"Processing {len(boundaries)} runs with {n_workers} workers")
+        process_runs_parallel(raw, boundaries, args, n_workers, filtered=filtered, base_key=base_key)
+        return
+
+    # Segment the runs
+    runs = segment_runs(raw, chapter_events, run_definitions,
+                        remaining_time_at_beginning=args.remaining_time_at_beginning, boundaries=boundaries)
+
+    for (run_num, start_onset, end_onset), run_raw in runs:
+        crop_start_time = start_onset
+        run_filtered = None
+        if filtered is not None:
+            run_filtered, crop_start_time = crop_filtered_run(filtered, start_onset, end_onset)
+        run_key = stage_key('run', base_key, {'tmin': start_onset, 'tmax': end_onset})
+        process_single_run(run_num, run_raw, crop_start_time, args, run_output_root=args.processed_data_root,
+                           filtered_raw=run_filtered, run_key=run_key)
+        del run_raw, run_filtered
 
 
 def main():
@@ -357,9 +619,29 @@ def main():
     parser.add_argument('--ica_method', type=str, default='infomax')
     parser.add_argument('--ica_n_components', type=int, default=40)
     parser.add_argument('--rereference', type=str, default='average')
+    # Headless mode: bad channels and ICA exclusions are selected automatically, no GUI
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--bad_z_threshold', type=float, default=5.0)
+    parser.add_argument('--flat_threshold', type=float, default=1e-7)
+    parser.add_argument('--bad_corr_threshold', type=float, default=0.4)
+    parser.add_argument('--bad_window_fraction', type=float, default=0.01)
+    parser.add_argument('--eog_channels', type=str, nargs='+', default=EOG_PROXY_CHANNELS)
+    parser.add_argument('--eog_threshold', type=float, default=3.0)
+    parser.add_argument('--ecg_threshold', type=float, default=3.0)
+    # Interpolate, resample and filter the whole recording once before segmenting into runs
+    parser.add_argument('--filter_whole_recording', action='store_true')
+    # Stage cache: filtered raw, interpolated raw and fitted ICA are reused across calls
+    parser.add_argument('--cache_dir', type=str, default=None)
+    # Parallel runs (headless only): 1 runs serially, 0 uses all cores
+    parser.add_argument('--n_jobs', type=int, default=1)
+    parser.add_argument('--memory_budget', type=float, default=None)  # GB for all run workers together
 
     args = parser.parse_args()
 
+    if args.headless:
+        import matplotlib
+        matplotlib.use('Agg')
+
     process_eeg_segments(eeg_path=args.eeg_path, args=args)
 
 
@@ -0,0 +1,108 @@
+'''
+On-disk cache of the expensive stages of preprocessing.py.
+
+Every stage output (filtered raw, interpolated raw, fitted ICA) is stored under
+cache_dir/{stage}/{key}/, where the key is a hash of the key of the stage's input
+and the stage parameters. Keys chain from the input recording, so changing one
+parameter changes the key of that stage and of every later stage, and a rerun
+resumes from the first affected stage.
+
+The recording itself is identified by the name, size and modification time of
+every file in the .mff directory; reading gigabytes of EEG only to hash them
+would cost more than the stages the cache saves.
+'''
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import mne
+from mne.preprocessing import read_ica
+
+RAW_FILE = "data_raw.fif"
+ICA_FILE = "data-ica.fif"
+
+
+def input_fingerprint(path):
+    '''
+    Hash of a file or directory tree from the relative path, size and mtime of every file.
+    '''
+    path = os.path.abspath(path)
+    entries = []
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                stat = os.stat(full)
+                entries.append((os.path.relpath(full, path), stat.st_size, stat.st_mtime_ns))
+    else:
+        stat = os.stat(path)
+        entries.append((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(json.dumps(entries).encode()).hexdigest()
+
+
+def stage_key(stage, parent_key, params):
+    '''
+    Key of a stage output.
+
+    :param stage: stage name
+    :param parent_key: key of the stage input
+    :param params: JSON-serializable dict of every parameter that changes the output
+    :return: hex digest, None when parent_key is None (caching disabled)
+    '''
+    if parent_key is None:
+        return None
+    payload = json.dumps({"stage": stage, "parent": parent_key, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def cached_stage(cache_dir, stage, key, compute, save, load):
+    '''
+    Load a stage output from the cache, or compute and store it.
+
+    :param cache_dir: cache root, None to always compute
+    :param compute: function returning the stage output
+    :param save: function (output, directory) writing the output into directory
+    :param load: function (directory) reading the output back
+    '''
+    if cache_dir is None or key is None:
+        return compute()
+
+    entry = os.path.join(cache_dir, stage, key)
+    if os.path.isdir(entry):
+        print(f'-------------------- {stage} loaded from cache {key[:12]} --------------------')
+        return load(entry)
+
+    result = compute()
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    # written next to the entry and renamed, so an interrupted write never looks like a hit
+    tmp = tempfile.mkdtemp(prefix=f".{key}.", dir=os.path.dirname(entry))
+    try:
+        save(result, tmp)
+        os.replace(tmp, entry)
+    except OSError:
+        # another worker stored the same entry first
+        if not os.path.isdir(entry):
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return result
+
+
+def cached_raw(cache_dir, stage, key, compute):
+    # double precision, a cache hit gives the same data as recomputing
+    return cached_stage(
+        cache_dir, stage, key, compute,
+        save=lambda raw, directory: raw.save(os.path.join(directory, RAW_FILE), fmt='double', overwrite=True),
+        load=lambda directory: mne.io.read_raw_fif(os.path.join(directory, RAW_FILE), preload=True),
+    )
+
+
+def cached_ica(cache_dir, key, compute):
+    return cached_stage(
+        cache_dir, "ica", key, compute,
+        save=lambda ica, directory: ica.save(os.path.join(directory, ICA_FILE), overwrite=True),
+        load=lambda directory: read_ica(os.path.join(directory, ICA_FILE)),
+    )